@@ -8,6 +8,7 @@ from simulation.switch import Switch, PriorityMap, TransmissionSelectionAlgorith
     SwitchPortParam
 from simulation.generators import *
 from simulation.simulation_wrapper import *
+from simulation.scenario import ScenarioFactory
 
 
 def some_frame_generator(env, source, destination, payload=750, priority=1):
@@ -16,21 +17,41 @@ def some_frame_generator(env, source, destination, payload=750, priority=1):
         yield MonitoredFrame(env, source, destination, payload, priority)
 
 
+def foo4_factory(seed):
+    env = NetworkEnvironment(name="Test", seed=seed, verbose=False)
+    builder = env.builder
+    monitored_node = Flow2(env, "Source", some_frame_generator(env, "Source", "Sink", priority=0), monitor=True)
+    sink = SinglePacket(env, "Sink", "broadcast", 0, 0)
+    switch_param = SwitchPortParam(1)
+    switch_param.tsa_map.\
+        map_traffic_class_transmission_selection_algorithm(0, TransmissionSelectionAlgorithmMap.credit_based_shaper)
+    switch_param.tsa_bandwidth.map_traffic_class_bandwidth(0, 0.5)
+    switch = Switch(env, "Switch", monitor=True, preemption=False)
+    builder.append_nodes(monitored_node, switch, sink)
+    builder.connect_nodes(monitored_node, switch, 10, None, 0, switch_param)
+    builder.connect_nodes(switch, sink, 10, None, 0, switch_param)
+    return env
+
+
 def foo4():
     while True:
-        env = NetworkEnvironment(name="Test", seed=1337, verbose=False)
-        builder = env.builder
-        monitored_node = Flow2(env, "Source", some_frame_generator(env, "Source", "Sink", priority=0), monitor=True)
-        sink = SinglePacket(env, "Sink", "broadcast", 0, 0)
-        switch_param = SwitchPortParam(1)
-        switch_param.tsa_map.\
-            map_traffic_class_transmission_selection_algorithm(0, TransmissionSelectionAlgorithmMap.credit_based_shaper)
-        switch_param.tsa_bandwidth.map_traffic_class_bandwidth(0, 0.5)
-        switch = Switch(env, "Switch", monitor=True, preemption=False)
-        builder.append_nodes(monitored_node, switch, sink)
-        builder.connect_nodes(monitored_node, switch, 10, None, 0, switch_param)
-        builder.connect_nodes(switch, sink, 10, None, 0, switch_param)
-        yield env
+        yield foo4_factory(1337)
+
+
+# foo4 as plain data, see simulation.scenario
+foo4_scenario = {"name": "Test",
+                 "port_params": {"cbs": {"traffic_classes": 1, "tsa": {0: "credit_based_shaper"},
+                                         "bandwidth": {0: 0.5}}},
+                 "nodes": [{"type": "flow2", "address": "Source", "monitor": True,
+                            "frames": {"destination": "Sink", "priority": 0,
+                                       "payload": {"distribution": "uniform", "a": 250, "b": 1300}}},
+                           {"type": "switch", "address": "Switch", "monitor": True},
+                           {"type": "single_packet", "address": "Sink", "destination": "broadcast", "payload": 0,
+                            "wait_until": 0}],
+                 "links": [{"nodes": ["Source", "Switch"], "bandwidth": 10, "port_params": ["cbs"]},
+                           {"nodes": ["Switch", "Sink"], "bandwidth": 10, "port_params": ["cbs"]}]}
+# picklable simulation_factory of foo4_scenario for the parallel wrappers
+foo4_scenario_factory = ScenarioFactory(foo4_scenario)
 
 
 def gen(env):
@@ -70,3 +91,5 @@ tmp.run(1000000)
 
 # simulate_same_multiple_csv(foo2(), 10, 100000, "foooo")
 #simulate_same_multiple_csv(foo4(), 3, 100000, file_name="test")
+# result = simulate_same_multiple_parallel(foo4_factory, 15, 1000000, 0.95, master_seed=1337, workers=4)
+# result = simulate_same_multiple_parallel(foo4_scenario_factory, 15, 1000000, 0.95, master_seed=1337)
@@ -0,0 +1,72 @@
+"""
+python -m simulation scenario.json -n 10 -t 1000000 -w 4 -o result.json
+runs replications of a scenario (see simulation.scenario) and writes the combined monitor results as json
+"""
+from time import perf_counter
+
+start_time = perf_counter()
+
+import argparse
+import json
+import sys
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(prog="python -m simulation", description="runs replications of a scenario file")
+    parser.add_argument("scenario", help="scenario json file, see simulation.scenario")
+    parser.add_argument("-n", "--replications", type=int, default=10,
+                        help="replications, the maximum number with --half-width")
+    parser.add_argument("-t", "--runtime", type=float, default=1000000, help="runtime of each replication in µs")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes, default = cpu count")
+    parser.add_argument("-o", "--output", default=None, help="json result file, default = stdout")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="master seed of the replications")
+    parser.add_argument("-c", "--confidence", type=float, default=0.95, help="confidence coefficient")
+    parser.add_argument("--warmup", default=None, help="warm-up time in µs or mser")
+    parser.add_argument("--half-width", type=float, default=None,
+                        help="run replications until every relative confidence interval half-width is below this")
+    parser.add_argument("--cache", default=None, help="result cache directory")
+    parser.add_argument("--force", action="store_true", help="recompute cached results")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+    from simulation.scenario import load_scenario, ScenarioFactory
+    from simulation.simulation_wrapper import simulate_same_multiple_parallel, simulate_same_multiple_sequential
+    from simulation.cache import ResultCache
+    import_time = perf_counter() - start_time
+
+    simulation_factory = ScenarioFactory(load_scenario(arguments.scenario))
+    warmup = arguments.warmup
+    if warmup is not None and warmup != "mser":
+        warmup = float(warmup)
+    cache = ResultCache(arguments.cache, force=arguments.force) if arguments.cache is not None else None
+    print("startup: %0.3f s (imports %0.3f s)" % (perf_counter() - start_time, import_time), file=sys.stderr)
+
+    simulation_start_time = perf_counter()
+    # build time of every replication, measured where the replication builds its environment
+    build_times = []
+    if arguments.half_width is not None:
+        result = simulate_same_multiple_sequential(simulation_factory, arguments.runtime, arguments.confidence,
+                                                   arguments.half_width, max_count=arguments.replications,
+                                                   master_seed=arguments.seed, workers=arguments.workers,
+                                                   warmup=warmup, cache=cache, build_times=build_times)
+    else:
+        result = simulate_same_multiple_parallel(simulation_factory, arguments.replications, arguments.runtime,
+                                                 arguments.confidence, master_seed=arguments.seed,
+                                                 workers=arguments.workers, warmup=warmup, cache=cache,
+                                                 build_times=build_times)
+    print("simulation: %0.3f s (scenario build %0.3f s per replication, %d replications)" %
+          (perf_counter() - simulation_start_time, sum(build_times) / max(build_times.__len__(), 1),
+           build_times.__len__()), file=sys.stderr)
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2, default=float)
+    else:
+        json.dump(result, sys.stdout, indent=2, default=float)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+# hash of the source of the simulation package, computed once per process
+_code_version = None
+
+
+def code_version():
+    """
+    :return: sha256 of all .py files of the simulation package, changes whenever the simulator changes
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        package = os.path.dirname(os.path.abspath(__file__))
+        for file_name in sorted(os.listdir(package)):
+            if file_name.endswith(".py"):
+                digest.update(file_name.encode("utf-8"))
+                with open(os.path.join(package, file_name), "rb") as file:
+                    digest.update(file.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+# { file name: (modification time, size, sha256) }, files are only hashed again when they change
+_file_hashes = {}
+
+
+def file_hash(file_name):
+    """
+    :return: sha256 of the content of file_name
+    """
+    stat = os.stat(file_name)
+    cached = _file_hashes.get(file_name)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    _file_hashes[file_name] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class FileInput(str):
+    """
+    file name of an input of a simulation (e.g. a replayed trace), usable wherever the plain file name is.
+    describe covers the content of the file, a plain string is only a string
+    """
+    def describe(self):
+        return {"file": str(self), "sha256": file_hash(self)}
+
+
+def describe(obj):
+    """
+    json serializable description of a simulation factory (function, functools.partial, ScenarioFactory) or its
+    arguments. functions are described by their name, their source and the content of the file they are defined in,
+    so that a changed scenario or a changed helper function of the same module gets a new key.
+    objects with a describe method (ScenarioFactory, FileInput) are described by its result.
+    helper functions in other modules outside of the simulation package are not covered, see code_version
+    :raises TypeError: obj can not be described, e.g. an instance without a describe method
+    """
+    if isinstance(obj, functools.partial):
+        return {"function": describe(obj.func), "args": [describe(arg) for arg in obj.args],
+                "keywords": {key: describe(value) for key, value in sorted(obj.keywords.items())}}
+    if isinstance(obj, (list, tuple)):
+        return [describe(value) for value in obj]
+    if isinstance(obj, dict):
+        return {str(key): describe(value) for key, value in obj.items()}
+    if isinstance(obj, FileInput):
+        return obj.describe()
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "describe") and not isinstance(obj, type):
+        return {"class": "%s.%s" % (type(obj).__module__, type(obj).__qualname__), "value": describe(obj.describe())}
+    if hasattr(obj, "__qualname__"):
+        try:
+            source = inspect.getsource(obj)
+        except (OSError, TypeError):
+            source = ""
+        try:
+            module_hash = file_hash(inspect.getsourcefile(obj))
+        except (OSError, TypeError):
+            module_hash = ""
+        return {"name": "%s.%s" % (obj.__module__, obj.__qualname__), "source": source, "module": module_hash}
+    # a repr would contain memory addresses or leave out the state the result depends on
+    raise TypeError("%s can not be described for the cache key, give it a describe method" % type(obj).__qualname__)
+
+
+class ResultCache(object):
+    def __init__(self, path, max_size: int = None, max_age: float = None, force: bool = False):
+        """
+        on disk cache of replication results, one file per (scenario, seed, runtime, .., code version)
+        entries are written to a temporary file and renamed, a crash never leaves a partial entry
+        :param path: cache directory
+        :param max_size: bytes, evict removes the least recently used entries above this size, None = no limit
+        :param max_age: seconds, evict removes entries which have not been used for this long, None = no limit
+        :param force: ignore cached entries, every result is computed and stored again
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.force = force
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, *args):
+        """
+        :param args: everything the result depends on, e.g. simulation_factory, seed, runtime
+        :return: hex digest of args and the code version
+        """
+        description = json.dumps([describe(arg) for arg in args] + [code_version()], sort_keys=True)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def file_name(self, key):
+        return os.path.join(self.path, key[:2], "%s.pickle" % key)
+
+    def get(self, key):
+        """
+        :return: cached value, None if there is none or force is set
+        """
+        if self.force:
+            return None
+        file_name = self.file_name(key)
+        try:
+            with open(file_name, "rb") as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # the modification time is the time of the last use
+        os.utime(file_name)
+        return value
+
+    def put(self, key, value):
+        file_name = self.file_name(key)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        descriptor, temporary_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump(value, file, pickle.HIGHEST_PROTOCOL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_file_name, file_name)
+        except BaseException:
+            os.remove(temporary_file_name)
+            raise
+
+    def entries(self):
+        """
+        :return: list of (last use, size, file name) of all entries
+        """
+        result = []
+        for directory, directory_names, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if file_name.endswith(".pickle"):
+                    file_name = os.path.join(directory, file_name)
+                    stat = os.stat(file_name)
+                    result.append((stat.st_mtime, stat.st_size, file_name))
+        return result
+
+    def evict(self):
+        """
+        removes entries older than max_age and the least recently used entries above max_size
+        :return: number of removed entries
+        """
+        entries = sorted(self.entries())
+        removed = 0
+        if self.max_age is not None:
+            oldest = time.time() - self.max_age
+            while removed < entries.__len__() and entries[removed][0] < oldest:
+                os.remove(entries[removed][2])
+                removed += 1
+        if self.max_size is not None:
+            size = sum(entry[1] for entry in entries[removed:])
+            while removed < entries.__len__() and size > self.max_size:
+                os.remove(entries[removed][2])
+                size -= entries[removed][1]
+                removed += 1
+        return removed
+
+    def clear(self):
+        for entry in self.entries():
+            os.remove(entry[2])
@@ -1,30 +1,87 @@
 import simpy
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
 import numpy as np
 
 from simulation.switch import Switch, SwitchPortParam
-from simulation.frame import Frame
+from simulation.frame import Frame, HopLog
 from simulation.node import Node
+from simulation.trace import Tracer, TRACE_OFF, TRACE_ALL
+from simulation.export import ColumnarExporter
+from simulation.statistics import mser
 
 
-class SendingProcessInspector(object):
-    def __init__(self, env, bandwidth, min_preemption_bytes=80, penalty_bytes=8):
+# one direction of a link as seen from the egress port of the sender, see NetworkBuilder.freeze
+Link = namedtuple("Link", ["receiver", "port_in", "bandwidth", "physical_delay"])
+
+
+class Transmission(object):
+    """
+    resumable transmission of one frame over one link, used for frame preemption
+    instead of a sending process there is only one scheduled timeout at a time. pausing forgets the timeout,
+    resuming schedules a new one for the remaining time plus the time of the penalty bytes
+    """
+    def __init__(self, env, frame: Frame, sender: Node, receiver: Node, port_in: int, bandwidth, sending_time,
+                 min_preemption_bytes=80, penalty_bytes=8):
+        """
+        :param env: NetworkEnvironment
+        :param frame: frame that is being send
+        :param sender: sending node
+        :param receiver: receiving node
+        :param port_in: receiving node ingress port
+        :param bandwidth: bandwidth of the link
+        :param sending_time: time it takes to send this frame
+        :param min_preemption_bytes: minimum amount of bytes left to send before the transmission may be paused
+        :param penalty_bytes: amount of extra bytes to send for resuming the transmission
+        """
         self.env = env
+        self.frame = frame
+        self.sender = sender
+        self.receiver = receiver
+        self.port_in = port_in
         self.bandwidth = bandwidth
         self.min_preemption_bytes = min_preemption_bytes
-        self.penalty_time = penalty_bytes * 8 / bandwidth
         self.penalty_bytes = penalty_bytes
-        self.finish_time = 0
+        self.penalty_time = penalty_bytes * 8 / bandwidth
+        # time left to send (including physical delay), only valid while paused
+        self.sending_time = sending_time
+        self.start_time = env.now
+        # sim_time when the frame is received, -1 while paused
+        self.finish_time = env.now + sending_time
+        self.sent = False
+        # timeout to yield until the frame is received, None while paused
+        self.timeout = env.timeout(sending_time)
+        self.timeout.callbacks.append(self.on_timeout)
 
-    def process_interruptable(self):
-        bytes_left = (self.finish_time - self.env.now) * self.bandwidth / 8
-        if self.finish_time < 0 or bytes_left - self.penalty_bytes > self.min_preemption_bytes:
-            return True
-        else:
-            return False
+    @property
+    def remaining_bytes(self):
+        if self.finish_time < 0:
+            return self.sending_time * self.bandwidth / 8
+        return (self.finish_time - self.env.now) * self.bandwidth / 8
+
+    def interruptable(self):
+        """
+        :return: True if enough bytes are left to pause this transmission
+        """
+        return self.finish_time < 0 or self.remaining_bytes - self.penalty_bytes > self.min_preemption_bytes
 
-    def get_penalty_time(self):
-        return self.penalty_time
+    def pause(self):
+        self.sending_time -= self.env.now - self.start_time
+        self.finish_time = -1
+        # the scheduled timeout can not be removed, on_timeout ignores it
+        self.timeout = None
+
+    def resume(self):
+        self.start_time = self.env.now
+        # some bytes need to be transmitted to signal that the frame is continued
+        self.sending_time += self.penalty_time
+        self.finish_time = self.env.now + self.sending_time
+        self.timeout = self.env.timeout(self.sending_time)
+        self.timeout.callbacks.append(self.on_timeout)
+
+    def on_timeout(self, event):
+        if event is self.timeout:
+            self.sent = True
+            self.env.deliver_frame(self.frame, self.sender, self.receiver, self.port_in)
 
 
 class NetworkEnvironment(simpy.Environment):
@@ -35,16 +92,23 @@ class NetworkEnvironment(simpy.Environment):
     id = {}
 
     def __init__(self, name="no_name", seed: int = None, channel_types: dict = None, verbose: bool = True,
-                 min_preemption_bytes: int = 80, preemption_penalty_bytes: int = 8, *args, **kwargs):
+                 min_preemption_bytes: int = 80, preemption_penalty_bytes: int = 8, tracer: Tracer = None,
+                 quantiles=(0.5, 0.99, 0.999), quantile_relative_accuracy: float = 0.01,
+                 exporter: ColumnarExporter = None, *args, **kwargs):
         """
         :param name: Name of this Simulation
         :param seed: Seed of this Simulations random generator
         :param channel_types: available types of connections between nodes for this simulation. Form must be:
         channel_types = { type: physical_travel_factor (in m/µs), ...}
-        :param verbose: bool for printing events
+        :param verbose: bool for printing events, same as a Tracer with TRACE_ALL if no tracer is given
         :param min_preemption_bytes: int, minimum amount of bytes left to send before interrupting sending_event
         for frame preemption
         :param preemption_penalty_bytes: int, amount of extra bytes to send for interrupting a sending_event
+        :param tracer: Tracer which receives trace events
+        :param quantiles: latency quantiles reported by get_monitor_results
+        :param quantile_relative_accuracy: relative accuracy of the QuantileSketches of monitored nodes
+        :param exporter: ColumnarExporter, monitored switches and the MonitoredFrames of monitored nodes write their
+        table rows to it while the simulation runs. hops are then not kept in hop_log. may also be set before run
         """
         super(NetworkEnvironment, self).__init__(*args, **kwargs)
         self.name = name
@@ -57,21 +121,57 @@ class NetworkEnvironment(simpy.Environment):
         self.next_frame_id = 0
         self.random = np.random.RandomState(seed=seed)
         self.seed = seed if seed is not None else ""
+        # number of RandomStates given to block generators without one, see generators.default_random
+        self.default_streams = 0
         self.verbose = verbose
+        if tracer is None and verbose:
+            tracer = Tracer(TRACE_ALL)
+        self.tracer = tracer
+        # call sites compare against this before calling trace, TRACE_OFF = no tracing
+        self.trace_level = tracer.level if tracer is not None else TRACE_OFF
         self.min_preemption_bytes = min_preemption_bytes if min_preemption_bytes > 0 else 1
         self.preemption_penalty_bytes = preemption_penalty_bytes
+        self.quantiles = quantiles
+        self.quantile_relative_accuracy = quantile_relative_accuracy
         self.builder = NetworkBuilder(channel_types)
         self.nodes = self.builder.nodes
         self.table = self.builder.table
         self.stop_event = self.event()
-        self.sleep_event = self.event()
+        # hops of the MonitoredFrames recorded by monitored nodes, see MonitoredFrame.on_recorded
+        self.hop_log = HopLog()
+        self.exporter = exporter
+        # sim_time the monitored statistics start at, see reset_monitors
+        self.monitor_start_time = 0
 
     def sim_print(self, msg):
         if self.verbose:
             print("%0.2f: %s" % (self.now, msg))
 
+    def trace(self, event, address, frame: Frame, port=None):
+        """
+        passes a trace event to the tracer. check trace_level before calling this
+        :param event: trace event, e.g. simulation.trace.RECEIVED
+        :param address: address of the node
+        :param frame: frame of this event
+        :param port: port of this event, if there is one
+        """
+        self.tracer.trace(self.now, event, address, frame, port)
+
     # if until <= 0: run until stop() has been called
-    def run(self, until=None):
+    def run(self, until=None, warmup=None):
+        """
+        :param until: sim_time to run until, <= 0 = until stop() has been called
+        :param warmup: statistics of the monitored nodes before this sim_time are discarded, results only cover the
+        time from warmup to until. "mser" = the end of the warm-up is detected with MSER-5, see run_warmup, this needs
+        a finite until
+        """
+        if warmup == "mser":
+            if until is None or until <= 0:
+                raise ValueError("mser warm-up detection needs a finite until, it samples the time up to until")
+            self.run_warmup(until)
+        elif warmup is not None and warmup > self.now:
+            super(NetworkEnvironment, self).run(warmup)
+            self.reset_monitors()
         if isinstance(until, int) and until <= 0:
             super(NetworkEnvironment, self).run(until=self.stop_event)
         else:
@@ -80,6 +180,49 @@ class NetworkEnvironment(simpy.Environment):
     def stop(self):
         self.stop_event.succeed()
 
+    def run_warmup(self, until, sample_count: int = 1000, check_interval: int = 50):
+        """
+        runs until the end of the warm-up is detected and resets the monitors then. the number of queued frames of
+        all switches is sampled sample_count times until until, every check_interval samples MSER-5 is computed
+        on the samples. once it finds a truncation point the monitors are reset at the current sim_time, which is
+        at or after the truncation point. the monitors are not reset if no truncation point is found before until
+        :param until: sim_time the simulation runs until
+        :return: sim_time of the truncation point, None if there is none
+        """
+        interval = (until - self.now) / sample_count
+        samples = []
+        sample_times = []
+        for i in range(1, sample_count):
+            super(NetworkEnvironment, self).run(self.now + interval)
+            samples.append(self.get_queue_length())
+            sample_times.append(self.now)
+            if samples.__len__() % check_interval == 0:
+                truncated_samples = mser(samples)
+                if truncated_samples is not None:
+                    self.reset_monitors()
+                    return sample_times[truncated_samples]
+        return None
+
+    def reset_monitors(self):
+        """
+        discards the statistics of all monitored nodes, results only cover the time from now on
+        """
+        self.monitor_start_time = self.now
+        # frames recorded before stop logging their hops
+        self.hop_log = HopLog()
+        for node in self.nodes.values():
+            if node.monitor:
+                node.reset_monitor()
+
+    # number of frames queued in all switches
+    def get_queue_length(self):
+        length = 0
+        for node in self.nodes.values():
+            if isinstance(node, Switch):
+                for port_module in node.port_modules.values():
+                    length += port_module[0].length
+        return length
+
     def get_monitor_tables(self):
         """
         :return: dict of lists of monitored information
@@ -102,72 +245,78 @@ class NetworkEnvironment(simpy.Environment):
                 result[node.address] = node.get_monitor_results()
         return result
 
+    def get_monitor_sketches(self):
+        """
+        :return: { address: QuantileSketch or dict of QuantileSketches } of all monitored nodes, can be merged with
+        the sketches of other replications
+        """
+        result = {}
+        for node in self.nodes.values():
+            if node.monitor:
+                sketches = node.get_monitor_sketches()
+                if sketches is not None:
+                    result[node.address] = sketches
+        return result
+
     def get_frame_id(self):
         self.next_frame_id += 1
         return self.next_frame_id - 1
 
-    # returns a process to yield and an inspector
-    def send_frame(self, frame: Frame, source_address, port_out: int, extra_bytes: int = 0, inspector: bool = False):
+    # returns a timeout to yield or a Transmission
+    def send_frame(self, frame: Frame, source_address, port_out: int, extra_bytes: int = 0, preemptable: bool = False):
         # receiver = [address, port_in, bandwidth, physical_delay]
         """
         :param frame: frame to send
         :param source_address: address of the sending node
         :param port_out: egress port of the sending node
         :param extra_bytes: additional bytes to transmit
-        :param inspector: bool if you want an inspector
-        :return: returns a sending_event process to yield and an inspector
+        :param preemptable: bool if the transmission may be paused and resumed
+        :return: returns a sending_event to yield, or a Transmission if preemptable
         """
         receiver = self.table[source_address][port_out]
-        # frame.__len__() in Bytes | receiver[2] = bandwidth in b/µs | receiver[3] physical delay in µs
-        sending_time = (((frame.__len__() + extra_bytes) * 8) / receiver[2]) + receiver[3]
-        # inspector contains finish_time, the sim_time when the frame is send. this is important for preemption
-        if inspector:
-            inspector = SendingProcessInspector(self, receiver[2], self.min_preemption_bytes,
-                                                self.preemption_penalty_bytes)
-            return self.process(self.send_frame_process(frame, self.nodes[receiver[0]], receiver[1], sending_time,
-                                                        self.nodes[source_address], inspector)), inspector
-        else:
-            return self.process(self.send_frame_process(frame, self.nodes[receiver[0]], receiver[1], sending_time,
-                                                        self.nodes[source_address]))
+        return self.transmit(frame, self.nodes[source_address], self.nodes[receiver[0]], receiver[1], receiver[2],
+                             receiver[3], extra_bytes, preemptable)
 
-    # do not interrupt this process without an inspector and checking finish_time
-    # (this can cause a bug when you interrupt this process at the same time as it would be processed)
-    # for this reason a runtime error (inspector is none) will occur to prevent interrupting without an inspector
-    def send_frame_process(self, frame: Frame, receiver: Node, port_in: int, sending_time: float, sender: Node,
-                           inspector: SendingProcessInspector = None):
+    def transmit(self, frame: Frame, sender: Node, receiver: Node, port_in: int, bandwidth, physical_delay,
+                 extra_bytes: int = 0, preemptable: bool = False):
         """
-        :param frame: frame that is being send
+        same as send_frame with the link already resolved, Node.pop calls this directly once the topology is frozen
+        :param sender: sending node
         :param receiver: receiving node
         :param port_in: receiving node ingress port
-        :param sending_time: time it takes to send this frame
+        :param bandwidth: bandwidth of the link in b/µs
+        :param physical_delay: physical delay of the link in µs
+        :return: returns a sending_event to yield, or a Transmission if preemptable
+        """
+        # frame.length in Bytes
+        sending_time = (((frame.length + extra_bytes) * 8) / bandwidth) + physical_delay
+        if preemptable:
+            return Transmission(self, frame, sender, receiver, port_in, bandwidth, sending_time,
+                                self.min_preemption_bytes, self.preemption_penalty_bytes)
+        sending_event = self.timeout(sending_time)
+        sending_event.callbacks.append(lambda event: self.deliver_frame(frame, sender, receiver, port_in))
+        return sending_event
+
+    def freeze(self):
+        """
+        see NetworkBuilder.freeze
+        :return: returns NetworkEnvironment
+        """
+        self.builder.freeze()
+        return self
+
+    def deliver_frame(self, frame: Frame, sender: Node, receiver: Node, port_in: int):
+        """
+        called when the last bit of frame arrived at the receiver
+        :param frame: frame that has been send
         :param sender: sending node
-        :param inspector: inspector
-        """
-        start_time = self.now
-        if inspector is not None:
-            inspector.finish_time = self.now + sending_time
-        sending = True
-        while sending_time > 0:
-            try:
-                if sending:
-                    yield self.timeout(sending_time)
-                    sending_time = 0
-                    receiver.push(frame, port_in)
-                    frame.on_hop(sender, receiver)
-                    if receiver.address == frame.destination:
-                        frame.on_destination_reached(receiver)
-                else:
-                    yield self.sleep_event
-            except simpy.Interrupt:
-                if sending:
-                    sending_time -= self.now - start_time
-                    inspector.finish_time = -1
-                else:
-                    start_time = self.now
-                    # some bytes need to be transmitted to signal that the frame is continued
-                    sending_time += inspector.get_penalty_time()
-                    inspector.finish_time = self.now + sending_time
-                sending = not sending
+        :param receiver: receiving node
+        :param port_in: receiving node ingress port
+        """
+        receiver.push(frame, port_in)
+        frame.on_hop(sender, receiver)
+        if receiver.address == frame.destination:
+            frame.on_destination_reached(receiver)
 
 
 class NetworkBuilder(object):
@@ -181,6 +330,13 @@ class NetworkBuilder(object):
         self.table = defaultdict(dict)
         # {source: {destination: [destination, port_in, bandwidth, physical_delay] }}
         self.table2 = defaultdict(list)
+        # links of connect_topology stay in the adjacency arrays of their Topology instead of table2, see link
+        # [(Topology, physical_delay of each link)]
+        self.topologies = []
+        # { address: { number of the topology in topologies: index of the node in the topology } }
+        self.topology_nodes = defaultdict(dict)
+        # set by freeze, nodes and links can not be changed afterwards
+        self.frozen = False
 
     # time one bit takes to travel the physical layer
     def physical_delay(self, channel_type, channel_length):
@@ -198,6 +354,8 @@ class NetworkBuilder(object):
         :param nodes: Node[s] to append
         :return: returns NetworkBuilder
         """
+        if self.frozen:
+            raise RuntimeError("can not append nodes, the topology is frozen")
         for node in nodes:
             self.nodes[node.address] = node
         return self
@@ -214,6 +372,8 @@ class NetworkBuilder(object):
         :param switch_params: up to two SwitchPortParam. The first SwitchPortParam is used for the first Switch
         :return: returns NetworkBuilder
         """
+        if self.frozen:
+            raise RuntimeError("can not connect %s and %s, the topology is frozen" % (node_a, node_b))
         node_a_dict = self.table[node_a.address]
         node_b_dict = self.table[node_b.address]
         port_a = node_a_dict.__len__() + 1
@@ -241,3 +401,152 @@ class NetworkBuilder(object):
         self.table2[(node_a.address, node_b.address)] = [bandwidth, physical_delay]
         self.table2[(node_b.address, node_a.address)] = [bandwidth, physical_delay]
         return self
+
+    def link(self, sender_address, receiver_address):
+        """
+        :return: [bandwidth, physical_delay] of the link from sender_address to receiver_address
+        :raises KeyError: the nodes are not connected
+        """
+        connection_type = self.table2.get((sender_address, receiver_address))
+        if connection_type is not None:
+            return connection_type
+        receiver_nodes = self.topology_nodes.get(receiver_address, {})
+        for number, sender in self.topology_nodes.get(sender_address, {}).items():
+            receiver = receiver_nodes.get(number)
+            if receiver is None:
+                continue
+            topology, physical_delays = self.topologies[number]
+            first_entry = topology.offsets[sender]
+            entries = np.flatnonzero(topology.neighbours[first_entry:topology.offsets[sender + 1]] == receiver)
+            if entries.__len__() > 0:
+                # the last of parallel links, like table2
+                link = topology.links[first_entry + entries[-1]]
+                return [float(topology.bandwidth[link]), physical_delays[link]]
+        raise KeyError((sender_address, receiver_address))
+
+    def connect_topology(self, topology, channel_type=None, switch_param: SwitchPortParam = None):
+        """
+        connects all links of topology (see simulation.topology) in one pass over its adjacency arrays, the ports
+        are the same as with one connect_nodes call per link in link order. the nodes have to be appended already.
+        topology is kept, link answers the bandwidth and physical delay of its links from its arrays
+        :param topology: Topology
+        :param channel_type: channel_type of all links
+        :param switch_param: SwitchPortParam of all switch ports, None = one default SwitchPortParam for all ports
+        :return: returns NetworkBuilder
+        """
+        if self.frozen:
+            raise RuntimeError("can not connect the links of topology, the topology is frozen")
+        addresses = topology.addresses
+        nodes = [self.nodes[address] for address in addresses]
+        # nodes may already have ports, the ports of topology follow them
+        first_ports = [self.table[address].__len__() for address in addresses]
+        if channel_type is not None and self.channel_types is not None:
+            physical_delays = (topology.channel_length / self.channel_types[channel_type]).tolist()
+        else:
+            physical_delays = [0] * topology.link_count
+        bandwidths = topology.bandwidth.tolist()
+        offsets = topology.offsets.tolist()
+        neighbours = topology.neighbours.tolist()
+        links = topology.links.tolist()
+        ports_in = topology.ports_in.tolist()
+        switch_params = (switch_param if switch_param is not None else SwitchPortParam(),)
+        number = self.topologies.__len__()
+        self.topologies.append((topology, physical_delays))
+        for node_index, node in enumerate(nodes):
+            address = node.address
+            self.topology_nodes[address][number] = node_index
+            node_dict = self.table[address]
+            port_params = switch_params if isinstance(node, Switch) else ()
+            first_port = first_ports[node_index] - offsets[node_index] + 1
+            for entry in range(offsets[node_index], offsets[node_index + 1]):
+                neighbour = neighbours[entry]
+                link = links[entry]
+                bandwidth = bandwidths[link]
+                physical_delay = physical_delays[link]
+                port = first_port + entry
+                node_dict[port] = [addresses[neighbour], first_ports[neighbour] + ports_in[entry], bandwidth,
+                                   physical_delay]
+                node.add_port(port, bandwidth, *port_params)
+        return self
+
+    def build_forwarding_tables(self):
+        """
+        computes shortest path (hop count) forwarding entries for every destination from table and installs them
+        into every Switch. the switches then forward without self learning, aging and flooding.
+        call this after all nodes are connected
+        :return: returns NetworkBuilder
+        """
+        forwarding_tables = {address: {} for address, node in self.nodes.items() if isinstance(node, Switch)}
+        for destination in self.nodes:
+            # breadth-first search from the destination, only switches forward frames
+            visited = {destination}
+            queue = deque([destination])
+            while queue.__len__() > 0:
+                address = queue.popleft()
+                if address != destination and address not in forwarding_tables:
+                    continue
+                for neighbour in self.table[address].values():
+                    # neighbour = [address, port_in, bandwidth, physical_delay]
+                    # port_in of the neighbour is its port_out towards the destination
+                    if neighbour[0] not in visited:
+                        visited.add(neighbour[0])
+                        if neighbour[0] in forwarding_tables:
+                            forwarding_tables[neighbour[0]][destination] = neighbour[1]
+                        queue.append(neighbour[0])
+        for address, forwarding_table in forwarding_tables.items():
+            self.nodes[address].forwarding_table = forwarding_table
+        return self
+
+    def build_spanning_tree(self, root=None):
+        """
+        computes a spanning tree with a breadth-first search from root and restricts broadcasting (unknown
+        destinations, "broadcast") of every Switch to its tree ports, so a broadcast crosses every tree link once
+        even if the network has loops. the other links are only blocked for broadcasts, known destinations may
+        still be forwarded over them. every connected part of the network gets its own tree.
+        call this after all nodes are connected
+        :param root: address of the root Switch, None = the first appended Switch
+        :return: returns NetworkBuilder
+        """
+        flood_ports = {address: [] for address, node in self.nodes.items() if isinstance(node, Switch)}
+        roots = list(flood_ports)
+        if root is not None:
+            if root not in flood_ports:
+                raise ValueError("root %s is not the address of a Switch" % str(root))
+            roots.insert(0, root)
+        visited = set()
+        for tree_root in roots:
+            if tree_root in visited:
+                continue
+            visited.add(tree_root)
+            queue = deque([tree_root])
+            while queue.__len__() > 0:
+                address = queue.popleft()
+                for port_out, neighbour in self.table[address].items():
+                    # neighbour = [address, port_in, bandwidth, physical_delay]
+                    if neighbour[0] not in visited:
+                        visited.add(neighbour[0])
+                        flood_ports[address].append(port_out)
+                        # only switches forward frames, other nodes are leaves of the tree
+                        if neighbour[0] in flood_ports:
+                            flood_ports[neighbour[0]].append(neighbour[1])
+                            queue.append(neighbour[0])
+        for address, ports in flood_ports.items():
+            self.nodes[address].flood_ports = tuple(sorted(ports))
+        return self
+
+    def freeze(self):
+        """
+        compiles table into one tuple of Links per node, node.links[port_out] (ports start at 1, links[0] is None).
+        nodes then send without looking up table and nodes for every frame. call this after all nodes are connected,
+        connect_nodes and append_nodes raise a RuntimeError afterwards
+        :return: returns NetworkBuilder
+        """
+        for address, node in self.nodes.items():
+            ports = self.table.get(address, {})
+            links = [None] * (ports.__len__() + 1)
+            for port_out, receiver in ports.items():
+                # receiver = [address, port_in, bandwidth, physical_delay]
+                links[port_out] = Link(self.nodes[receiver[0]], receiver[1], receiver[2], receiver[3])
+            node.links = tuple(links)
+        self.frozen = True
+        return self
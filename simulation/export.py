@@ -0,0 +1,218 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# column kinds
+FLOAT = "float"
+INT = "int"
+BOOL = "bool"
+# repeated values (names, addresses, actions), stored as int32 codes into the categories of the table
+CATEGORY = "category"
+
+DTYPES = {FLOAT: np.dtype("<f8"), INT: np.dtype("<i8"), BOOL: np.dtype("|b1"), CATEGORY: np.dtype("<i4")}
+
+# same columns as Switch.get_monitor_table
+SWITCH_COLUMNS = (("sim_name", CATEGORY), ("sim_id", INT), ("sim_seed", CATEGORY),
+                  ("switch_address", CATEGORY), ("egress_port", CATEGORY), ("d_trans", FLOAT), ("d_prop", FLOAT),
+                  ("frame_id", INT), ("frame_source", CATEGORY), ("frame_destination", CATEGORY),
+                  ("frame_size", FLOAT), ("frame_traffic_class", INT),
+                  ("action", CATEGORY), ("action_time", FLOAT), ("action_q_len", INT))
+
+# same columns as HopLog.get_hop_table, except frame_last_hop: it is not known while the frame travels.
+# frame_hop_parent = row of the hop which brought the frame to the sender, -1 for the first hop.
+# a hop is the last hop of its frame if no row has it as frame_hop_parent, see last_hops
+HOP_COLUMNS = (("sim_name", CATEGORY), ("sim_id", INT), ("sim_seed", CATEGORY),
+               ("frame_id", INT), ("frame_source", CATEGORY), ("frame_destination", CATEGORY),
+               ("frame_size", FLOAT), ("frame_traffic_class", INT), ("frame_start_time", FLOAT),
+               ("frame_hop_count", INT), ("frame_hop_parent", INT),
+               ("frame_hop_sender", CATEGORY), ("frame_hop_sender_time", FLOAT),
+               ("frame_hop_receiver", CATEGORY), ("frame_hop_receiver_time", FLOAT),
+               ("d_trans", FLOAT), ("d_prop", FLOAT), ("d_queue", FLOAT), ("d_nodal", FLOAT), ("latency", FLOAT))
+
+# fixed size of the .npy header, so the final row count can be written over the placeholder on close
+NPY_HEADER_SIZE = 128
+
+
+def npy_header(dtype, length, header_size=NPY_HEADER_SIZE):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype),
+                                                                         length)
+    # magic (6) + version (2) + header length (2) + header + "\n"
+    header = header.ljust(header_size - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", header.__len__()) + header.encode("latin1")
+
+
+class ColumnarTable(object):
+    def __init__(self, path, columns, chunk_size: int = 65536, parquet: bool = False):
+        """
+        writes rows column by column to path/<column>.npy, chunk_size rows at a time. the files are valid
+        .npy files after close and can be opened with numpy.load(mmap_mode="r"), see read_table
+        :param path: directory of this table
+        :param columns: tuple of (name, kind), kind = FLOAT, INT, BOOL or CATEGORY
+        :param chunk_size: number of rows buffered in memory
+        :param parquet: additionally write path/table.parquet, needs pyarrow
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        # rows not written yet
+        self.rows = []
+        # rows written to the files
+        self.length = 0
+        # { column name: { value: code } }
+        self.categories = {name: {} for name, kind in columns if kind == CATEGORY}
+        self.files = []
+        for name, kind in columns:
+            file = open(os.path.join(path, "%s.npy" % name), "wb")
+            file.write(npy_header(DTYPES[kind], 0))
+            self.files.append(file)
+        self.parquet_writer = None
+        if parquet:
+            self.parquet_writer = ParquetChunkWriter(os.path.join(path, "table.parquet"), columns)
+
+    def append(self, row):
+        """
+        :param row: tuple of values in the order of columns
+        """
+        self.rows.append(row)
+        if self.rows.__len__() >= self.chunk_size:
+            self.flush()
+
+    # rows appended so far, written or not
+    def __len__(self):
+        return self.length + self.rows.__len__()
+
+    def flush(self):
+        if self.rows.__len__() == 0:
+            return
+        chunk = []
+        for (name, kind), values, file in zip(self.columns, zip(*self.rows), self.files):
+            if kind == CATEGORY:
+                codes = self.categories[name]
+                values = [codes.setdefault(value, codes.__len__()) for value in values]
+            array = np.array(values, dtype=DTYPES[kind])
+            file.write(array.tobytes())
+            chunk.append(array)
+        if self.parquet_writer is not None:
+            self.parquet_writer.write(chunk, self.categories)
+        self.length += self.rows.__len__()
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        for (name, kind), file in zip(self.columns, self.files):
+            file.seek(0)
+            file.write(npy_header(DTYPES[kind], self.length))
+            file.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        meta = {"length": self.length, "columns": [[name, kind] for name, kind in self.columns],
+                "categories": {name: list(codes.keys()) for name, codes in self.categories.items()}}
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+
+
+class ParquetChunkWriter(object):
+    def __init__(self, file_name, columns):
+        """
+        writes the chunks of a ColumnarTable as row groups of one parquet file, CATEGORY columns are
+        dictionary encoded strings
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("parquet export needs pyarrow")
+        self.pa = pyarrow
+        types = {FLOAT: pyarrow.float64(), INT: pyarrow.int64(), BOOL: pyarrow.bool_(),
+                 CATEGORY: pyarrow.dictionary(pyarrow.int32(), pyarrow.string())}
+        self.columns = columns
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+
+    def write(self, chunk, categories):
+        arrays = []
+        for (name, kind), array in zip(self.columns, chunk):
+            if kind == CATEGORY:
+                dictionary = self.pa.array([str(value) for value in categories[name].keys()], self.pa.string())
+                arrays.append(self.pa.DictionaryArray.from_arrays(self.pa.array(array, self.pa.int32()), dictionary))
+            else:
+                arrays.append(self.pa.array(array))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ColumnarExporter(object):
+    def __init__(self, path, chunk_size: int = 65536, parquet: bool = False):
+        """
+        streams the monitor tables of NetworkEnvironments to disk while they run, set as
+        NetworkEnvironment.exporter before running. one exporter may be shared by any number of replications
+        path/switch = rows of monitored switches, see SWITCH_COLUMNS
+        path/hop = hops of the MonitoredFrames recorded by monitored, not online nodes (the frames of
+        get_monitor_tables), see HOP_COLUMNS
+        :param path: output directory
+        :param chunk_size: rows per table kept in memory before they are written
+        :param parquet: additionally write a parquet file per table, needs pyarrow
+        """
+        self.path = path
+        self.switch_table = ColumnarTable(os.path.join(path, "switch"), SWITCH_COLUMNS, chunk_size, parquet)
+        self.hop_table = ColumnarTable(os.path.join(path, "hop"), HOP_COLUMNS, chunk_size, parquet)
+
+    def append_switch_row(self, row):
+        self.switch_table.append(row)
+
+    def append_hop_row(self, row):
+        """
+        :return: row index of this hop, the frame_hop_parent of the next hop
+        """
+        self.hop_table.append(row)
+        return self.hop_table.__len__() - 1
+
+    def close(self):
+        self.switch_table.close()
+        self.hop_table.close()
+
+
+def read_table(path, mmap_mode="r"):
+    """
+    opens a table written by ColumnarTable without loading it into memory
+    :param path: directory of the table, e.g. <exporter path>/switch
+    :param mmap_mode: see numpy.load, None = load into memory
+    :return: ({ column name: array }, { column name: list of values }), arrays of CATEGORY columns hold codes
+    into the list of values of that column
+    """
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    columns = {}
+    for name, kind in meta["columns"]:
+        file_name = os.path.join(path, "%s.npy" % name)
+        # an empty file can not be mapped
+        columns[name] = np.load(file_name, mmap_mode=mmap_mode if meta["length"] > 0 else None)
+    return columns, meta["categories"]
+
+
+def decode(codes, values):
+    """
+    :param codes: array of a CATEGORY column
+    :param values: list of values of this column
+    :return: object array of the values
+    """
+    table = np.empty(values.__len__(), dtype=object)
+    for code, value in enumerate(values):
+        table[code] = value
+    return table[codes]
+
+
+def last_hops(hop_columns):
+    """
+    :param hop_columns: columns of a hop table, see read_table
+    :return: bool array, True for every hop which is the last hop of its frame (frame_last_hop)
+    """
+    parent = hop_columns["frame_hop_parent"]
+    has_child = np.zeros(parent.__len__(), dtype=bool)
+    has_child[parent[parent >= 0]] = True
+    return ~has_child
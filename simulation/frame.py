@@ -1,3 +1,8 @@
+from array import array
+
+import numpy as np
+
+
 class Frame(object):
     """
     package to be sent
@@ -10,6 +15,9 @@ class Frame(object):
     each package has a priority
     each package has an automatically generated id
     """
+    # no __dict__ per frame, the length is cached and kept up to date by append_header / pop_header
+    __slots__ = ("id", "source", "destination", "_payload", "headers", "priority", "length")
+
     def __init__(self, env, source, destination, payload: int, priority: int = 0, header = (26, "Ethernet_Frame_Header")):
         """
 
@@ -21,14 +29,23 @@ class Frame(object):
         :param header: default size of 26 Bytes.
         """
         self.id = env.get_frame_id()
-        self.env = env
         self.source = source
         self.destination = destination
-        self.payload = payload
+        self._payload = payload
+        self.length = payload
         self.headers = []
         self.append_header(header)
         self.priority = priority
 
+    @property
+    def payload(self):
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload):
+        self.length += payload - self._payload
+        self._payload = payload
+
     def on_hop(self, sender, receiver):
         """
         called when this frame is received
@@ -44,6 +61,12 @@ class Frame(object):
         """
         pass
 
+    def on_recorded(self):
+        """
+        called when a monitored node keeps this frame for its monitor table
+        """
+        pass
+
     def peek_header(self):
         if self.headers.__len__() == 0:
             raise HeaderException("%s has no header" % str(self))
@@ -52,21 +75,21 @@ class Frame(object):
     def pop_header(self):
         if self.headers.__len__() == 0:
             raise HeaderException("%s has no header" % str(self))
-        return self.headers.pop()
+        header = self.headers.pop()
+        self.length -= header[0]
+        return header
 
     def append_header(self, header):
         self.headers.append(header)
+        self.length += header[0]
         return self
 
     def __len__(self):
-        t_len = self.payload
-        for header in self.headers:
-            t_len += header[0]
-        return t_len
+        return self.length
 
     def __str__(self):
         return "Frame(%d): (source: %s, dest: %s, size: %d, prio: %d)" % \
-               (self.id, str(self.source), str(self.destination), self.__len__(), self.priority)
+               (self.id, str(self.source), str(self.destination), self.length, self.priority)
 
 
 class HeaderException(Exception):
@@ -74,64 +97,166 @@ class HeaderException(Exception):
 
 
 class MonitoredFrame(Frame):
-    def __init__(self, *args, **kwargs):
-        super(MonitoredFrame, self).__init__(*args, **kwargs)
+    __slots__ = ("env", "start_time", "latency", "hops", "latency_statistics", "hop_log")
+
+    def __init__(self, env, *args, **kwargs):
+        super(MonitoredFrame, self).__init__(env, *args, **kwargs)
+        self.env = env
         self.start_time = self.env.now
         self.latency = -1
-        self.hops = QuickDirtyTree(time=self.env.now)
+        # { address: index of the hop in env.hop_log which brought this frame to address }
+        # with env.exporter: { address: (row in the hop table, receiver time, hop count) }
+        self.hops = {}
+        # statistics (RunningStatistics, QuantileSketch, ..) of the injecting node in online mode
+        # each one gets the latency of the first arrival
+        self.latency_statistics = None
+        # env.hop_log at the time a monitored node recorded this frame, None = hops are not logged
+        self.hop_log = None
+
+    def on_recorded(self):
+        self.hop_log = self.env.hop_log
 
     def on_hop(self, sender, receiver):
-        self.hops.append(sender.address, receiver.address, self.env.now)
+        # only frames of the monitor tables are logged or exported, reset_monitors replaces env.hop_log
+        if self.hop_log is not self.env.hop_log:
+            return
+        if self.env.exporter is not None:
+            self.export_hop(sender, receiver)
+        else:
+            self.hops[receiver.address] = self.env.hop_log.append(self.id, sender.address, receiver.address,
+                                                                  self.env.now, self.hops.get(sender.address, -1))
+
+    # writes the row of this hop to env.exporter instead of keeping it in env.hop_log
+    def export_hop(self, sender, receiver):
+        env = self.env
+        try:
+            parent, sender_time, hop_count = self.hops[sender.address]
+            hop_count += 1
+        except KeyError:
+            parent, sender_time, hop_count = -1, self.start_time, 0
+        # [bandwidth, physical_delay]
+        bandwidth, d_prop = env.builder.link(sender.address, receiver.address)
+        d_trans = self.length * 8 / bandwidth
+        d_nodal = env.now - sender_time
+        row = env.exporter.append_hop_row((env.name, env.id, env.seed, self.id, self.source, self.destination,
+                                           self.length, self.priority, self.start_time, hop_count, parent,
+                                           sender.address, sender_time, receiver.address, env.now,
+                                           d_trans, d_prop, d_nodal - d_trans - d_prop, d_nodal,
+                                           env.now - self.start_time))
+        self.hops[receiver.address] = (row, env.now, hop_count)
 
     def on_destination_reached(self, node):
+        if self.latency < 0 and self.latency_statistics is not None:
+            for statistics in self.latency_statistics:
+                statistics.add(self.env.now - self.start_time)
         self.latency = self.env.now - self.start_time
 
+    # hops are only logged once a monitored node recorded this frame, with env.exporter they are not kept at all
     def get_hop_table(self):
-        result = []
-        hop_table = self.hops.get_hop_table()
-        frame = {"sim_name": self.env.name, "sim_id": self.env.id, "sim_seed": self.env.seed,
-                 "frame_id": self.id, "frame_source": self.source, "frame_destination": self.destination,
-                 "frame_size": self.__len__(), "frame_traffic_class": self.priority,
-                 "frame_start_time": self.hops.time}
-        # { (address_a, address_b) = [bandwidth, physical_delay] }
-        connection_type_table = self.env.builder.table2
-        for hop in hop_table:
-            connection_type = connection_type_table[(hop["frame_hop_sender"], hop["frame_hop_receiver"])]
-            d_trans = self.__len__() * 8 / connection_type[0]
-            d_prop = connection_type[1]
-            d_nodal = hop["frame_hop_receiver_time"] - hop["frame_hop_sender_time"]
-            hop_things = {"d_trans": d_trans,
-                          "d_prop": d_prop,
-                          "d_queue": d_nodal - d_trans - d_prop,
-                          "d_nodal": d_nodal,
-                          "latency": hop["frame_hop_receiver_time"] - self.hops.time}
-            result.append({**frame, **hop, **hop_things})
-        return result
+        if self.hop_log is None or self.env.exporter is not None:
+            return []
+        return self.hop_log.get_hop_table(self.env, [self], sorted(self.hops.values()))
+
+
+class HopLog(object):
+    """
+    flat log of the hops of all MonitoredFrames of a NetworkEnvironment
+    each hop is one entry in every column: frame_id, sender, receiver, time, parent, hop_count
+    parent is the index of the hop which brought the frame to the sender, -1 if the sender is the first sender
+    """
+    def __init__(self):
+        self.frame_id = array("q")
+        # node indices, see addresses
+        self.sender = array("q")
+        self.receiver = array("q")
+        self.time = array("d")
+        self.parent = array("q")
+        self.hop_count = array("q")
+        self.addresses = []
+        self.address_index = {}
 
+    def get_address_index(self, address):
+        try:
+            return self.address_index[address]
+        except KeyError:
+            self.address_index[address] = self.addresses.__len__()
+            self.addresses.append(address)
+            return self.addresses.__len__() - 1
 
-class QuickDirtyTree(object):
-    def __init__(self, node=None, time=None):
-        self.node_address = node
-        self.time = time
-        self.children = []
+    def append(self, frame_id, sender_address, receiver_address, time, parent):
+        """
+        :return: index of this hop
+        """
+        self.frame_id.append(frame_id)
+        self.sender.append(self.get_address_index(sender_address))
+        self.receiver.append(self.get_address_index(receiver_address))
+        self.time.append(time)
+        self.parent.append(parent)
+        self.hop_count.append(self.hop_count[parent] + 1 if parent >= 0 else 0)
+        return self.frame_id.__len__() - 1
 
-    def append(self, sender_address, receiver_address, time):
-        if self.node_address is None:
-            self.node_address = sender_address
-        if self.node_address == sender_address:
-            self.children.append(QuickDirtyTree(receiver_address, time))
+    def get_hop_table(self, env, frames, hops=None):
+        """
+        computes the hop table of all hops of frames at once
+        :param env: NetworkEnvironment of frames
+        :param frames: list of MonitoredFrames
+        :param hops: indices of all hops of frames in increasing order, None = the hops of frames are searched in the log
+        :return: list of dicts, one per hop
+        """
+        if self.frame_id.__len__() == 0 or frames.__len__() == 0:
+            return []
+        frame_id = np.frombuffer(self.frame_id, dtype=np.int64)
+        parent = np.frombuffer(self.parent, dtype=np.int64)
+        time = np.frombuffer(self.time, dtype=np.float64)
+        ids = np.fromiter((frame.id for frame in frames), dtype=np.int64, count=frames.__len__())
+        if hops is None:
+            hops = np.nonzero(np.isin(frame_id, ids))[0]
         else:
-            for child in self.children:
-                child.append(sender_address, receiver_address, time)
-
-    def get_hop_table(self, hop_count=0):
-        hops = []
-        for child in self.children:
-            hops.append({"frame_hop_count": hop_count, "frame_last_hop": True,
-                         "frame_hop_sender": self.node_address, "frame_hop_sender_time": self.time,
-                         "frame_hop_receiver": child.node_address, "frame_hop_receiver_time": child.time})
-            child_table = child.get_hop_table(hop_count + 1)
-            if child_table.__len__() > 0:
-                hops[-1]["frame_last_hop"] = False
-                hops += child_table
-        return hops
+            hops = np.asarray(hops, dtype=np.int64)
+        if hops.__len__() == 0:
+            return []
+        # position of the frame of each hop in frames
+        order = np.argsort(ids)
+        frame_position = order[np.searchsorted(ids, frame_id[hops], sorter=order)]
+        frame_size = np.array([frame.__len__() for frame in frames], dtype=np.float64)[frame_position]
+        start_time = np.array([frame.start_time for frame in frames], dtype=np.float64)[frame_position]
+
+        sender = np.frombuffer(self.sender, dtype=np.int64)[hops]
+        receiver = np.frombuffer(self.receiver, dtype=np.int64)[hops]
+        links, link_position = np.unique(sender * self.addresses.__len__() + receiver, return_inverse=True)
+        link_position = link_position.reshape(-1)
+        # [bandwidth, physical_delay] of each link
+        connection_types = [env.builder.link(self.addresses[link // self.addresses.__len__()],
+                                             self.addresses[link % self.addresses.__len__()])
+                            for link in links.tolist()]
+        bandwidth = np.array([connection_type[0] for connection_type in connection_types],
+                             dtype=np.float64)[link_position]
+        d_prop = np.array([connection_type[1] for connection_type in connection_types],
+                          dtype=np.float64)[link_position]
+
+        hop_parent = parent[hops]
+        receiver_time = time[hops]
+        sender_time = np.where(hop_parent >= 0, time[hop_parent], start_time)
+        d_trans = frame_size * 8 / bandwidth
+        d_nodal = receiver_time - sender_time
+        d_queue = d_nodal - d_trans - d_prop
+        latency = receiver_time - start_time
+        # all children of a hop belong to the same frame, so they are among hops
+        last_hop = ~np.isin(hops, hop_parent)
+        hop_count = np.frombuffer(self.hop_count, dtype=np.int64)[hops]
+
+        result = []
+        for row in zip(frame_position.tolist(), hop_count.tolist(), last_hop.tolist(), sender.tolist(),
+                       sender_time.tolist(), receiver.tolist(), receiver_time.tolist(), d_trans.tolist(),
+                       d_prop.tolist(), d_queue.tolist(), d_nodal.tolist(), latency.tolist()):
+            frame = frames[row[0]]
+            result.append({"sim_name": env.name, "sim_id": env.id, "sim_seed": env.seed,
+                           "frame_id": frame.id, "frame_source": frame.source,
+                           "frame_destination": frame.destination, "frame_size": frame.__len__(),
+                           "frame_traffic_class": frame.priority, "frame_start_time": frame.start_time,
+                           "frame_hop_count": row[1], "frame_last_hop": row[2],
+                           "frame_hop_sender": self.addresses[row[3]], "frame_hop_sender_time": row[4],
+                           "frame_hop_receiver": self.addresses[row[5]], "frame_hop_receiver_time": row[6],
+                           "d_trans": row[7], "d_prop": row[8], "d_queue": row[9], "d_nodal": row[10],
+                           "latency": row[11]})
+        return result
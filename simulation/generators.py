@@ -1,17 +1,191 @@
+from itertools import repeat
+import csv
+
 import numpy as np
 
+from simulation.frame import Frame, MonitoredFrame
+
+# block generators draw block_size variates with one call of the random generator and yield them one by one.
+# they yield the same sequence as the scalar generator with the same parameters, as long as nothing else draws from
+# the same RandomState in between. give each block generator its own RandomState, e.g. stream_random(env, x).
+# without one they use default_random, never env.random, which would be advanced by block_size at once
+BLOCK_SIZE = 65536
+
+
+def stream_random(env, stream: int):
+    """
+    :param env: NetworkEnvironment
+    :param stream: number of this stream, different numbers give independent streams
+    :return: RandomState which only depends on the seed of env and stream
+    """
+    seed = env.seed if env.seed != "" else None
+    return np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed, spawn_key=(stream,))))
+
 
-def exp_generator(env, intensity):
+def default_random(env):
+    """
+    RandomState of its own for a block generator which got none, numbered in the order they are created
+    :param env: NetworkEnvironment
+    :return: RandomState independent of env.random and of every stream_random(env, x)
+    """
+    seed = env.seed if env.seed != "" else None
+    env.default_streams += 1
+    # a spawn key of two numbers never equals the one number spawn keys of stream_random
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=(0, env.default_streams))
+    return np.random.RandomState(np.random.MT19937(seed_sequence))
+
+
+def exp_generator(env, intensity, random=None):
+    random = random if random is not None else env.random
     mean = 1 / intensity
     while True:
-        yield env.random.exponential(mean)
+        yield random.exponential(mean)
+
+
+def uniform_generator(env, a=0.0, b=1.0, random=None):
+    random = random if random is not None else env.random
+    while True:
+        yield random.uniform(a, b)
 
 
-def uniform_generator(env, a=0.0, b=1.0):
+def normal_generator(env, mean=0.0, standard_deviation=1.0, random=None):
+    random = random if random is not None else env.random
     while True:
-        yield env.random.uniform(a, b)
+        yield random.normal(mean, standard_deviation)
+
+
+# pareto distribution with minimum value scale
+def pareto_generator(env, shape, scale=1.0, random=None):
+    random = random if random is not None else env.random
+    while True:
+        yield scale * (1 + random.pareto(shape))
 
 
 def static_generator(a):
     while True:
         yield a
+
+
+def block_generator(random_function, block_size, *args):
+    while True:
+        yield from random_function(*args, size=block_size).tolist()
+
+
+def exp_block_generator(env, intensity, random=None, block_size=BLOCK_SIZE):
+    random = random if random is not None else default_random(env)
+    return block_generator(random.exponential, block_size, 1 / intensity)
+
+
+def uniform_block_generator(env, a=0.0, b=1.0, random=None, block_size=BLOCK_SIZE):
+    random = random if random is not None else default_random(env)
+    return block_generator(random.uniform, block_size, a, b)
+
+
+def normal_block_generator(env, mean=0.0, standard_deviation=1.0, random=None, block_size=BLOCK_SIZE):
+    random = random if random is not None else default_random(env)
+    return block_generator(random.normal, block_size, mean, standard_deviation)
+
+
+def pareto_block_generator(env, shape, scale=1.0, random=None, block_size=BLOCK_SIZE):
+    random = random if random is not None else default_random(env)
+    while True:
+        yield from (scale * (1 + random.pareto(shape, size=block_size))).tolist()
+
+
+def static_block_generator(a):
+    return repeat(a)
+
+
+class SizeDistribution(object):
+    def __init__(self, sizes, weights):
+        """
+        discrete distribution of frame sizes, e.g. a measured histogram or an IMIX profile
+        sampling is O(1) per draw with an alias table (Vose's method)
+        :param sizes: frame sizes in Bytes, including the header
+        :param weights: relative frequency of each size, e.g. frame counts per histogram bin
+        """
+        self.sizes = np.asarray(sizes)
+        probability = np.asarray(weights, dtype=np.float64)
+        if self.sizes.__len__() == 0 or self.sizes.__len__() != probability.__len__():
+            raise ValueError("sizes and weights need the same non zero length")
+        if np.any(probability < 0) or probability.sum() <= 0:
+            raise ValueError("weights need to be >= 0 with a positive sum")
+        self.frequency = probability / probability.sum()
+        count = probability.__len__()
+        scaled = (self.frequency * count).tolist()
+        # column i: keep sizes[i] with probability[i], otherwise take sizes[alias[i]]
+        self.probability = np.ones(count, dtype=np.float64)
+        self.alias = np.arange(count)
+        small = [i for i in range(0, count) if scaled[i] < 1]
+        large = [i for i in range(0, count) if scaled[i] >= 1]
+        while small.__len__() > 0 and large.__len__() > 0:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    @classmethod
+    def from_cdf(cls, sizes, cumulative):
+        """
+        :param sizes: frame sizes in Bytes in ascending order
+        :param cumulative: cumulative frequency of each size, the last one is the total
+        """
+        return cls(sizes, np.diff(np.concatenate(([0], np.asarray(cumulative, dtype=np.float64)))))
+
+    @classmethod
+    def from_csv(cls, file_name, cumulative=False):
+        """
+        loads a histogram, one "size,weight" row per bin. a header row is skipped
+        :param cumulative: weights are a cdf, see from_cdf
+        """
+        sizes = []
+        weights = []
+        with open(file_name, "r", encoding="utf-8") as file:
+            for row in csv.reader(file):
+                try:
+                    sizes.append(float(row[0]))
+                    weights.append(float(row[1]))
+                except ValueError:
+                    continue
+        if cumulative:
+            return cls.from_cdf(sizes, weights)
+        return cls(sizes, weights)
+
+    def sample(self, random, size):
+        """
+        :param random: RandomState
+        :param size: number of frame sizes to draw
+        :return: numpy array of frame sizes
+        """
+        column = random.randint(0, self.sizes.__len__(), size)
+        keep = random.random_sample(size) < self.probability[column]
+        return self.sizes[np.where(keep, column, self.alias[column])]
+
+    # mean frame size in Bytes, e.g. to compute the offered load
+    def mean(self):
+        return float(np.dot(self.frequency, self.sizes))
+
+
+# frame sizes in Bytes including the 26 Bytes Ethernet_Frame_Header of Frame
+SIMPLE_IMIX = SizeDistribution((64, 570, 1518), (7, 4, 1))
+TOLLY_IMIX = SizeDistribution((64, 78, 576, 1518), (55, 5, 17, 23))
+
+
+def frame_size_generator(env, distribution: SizeDistribution, random=None, block_size=BLOCK_SIZE):
+    random = random if random is not None else default_random(env)
+    while True:
+        yield from distribution.sample(random, block_size).tolist()
+
+
+# frame_generator for Flow2 and FrameInjector, frame sizes are drawn from distribution
+def size_distribution_frame_generator(env, source, destination, distribution: SizeDistribution, priority=0,
+                                      monitored=True, random=None, block_size=BLOCK_SIZE,
+                                      header=(26, "Ethernet_Frame_Header")):
+    frame_type = MonitoredFrame if monitored else Frame
+    for size in frame_size_generator(env, distribution, random, block_size):
+        yield frame_type(env, source, destination, size - header[0], priority, header)
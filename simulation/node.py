@@ -3,7 +3,10 @@ from math import sqrt
 from collections import deque
 from simpy import Interrupt
 
-from simulation.frame import Frame
+from simulation.frame import Frame, MonitoredFrame
+from simulation.replay import read_trace
+from simulation.statistics import RunningStatistics, QuantileSketch
+from simulation.trace import TRACE_FRAME, TRACE_ALL, RECEIVED, SEND, SENDING
 
 
 class Node(object):
@@ -17,6 +20,8 @@ class Node(object):
         self.address = address
         self.monitor = monitor
         self.ports = []
+        # (None, Link of port 1, ..), set by NetworkBuilder.freeze
+        self.links = None
 
     def on_frame_received(self, frame: Frame, port_in: int):
         """
@@ -24,7 +29,8 @@ class Node(object):
         :param frame: received frame
         :param port_in: ingress port
         """
-        self.env.sim_print("%s: %s received on port %s" % (str(self.address), str(frame), str(port_in)))
+        if self.env.trace_level >= TRACE_FRAME:
+            self.env.trace(RECEIVED, self.address, frame, port_in)
 
     def on_frame_sending(self, frame: Frame, port_out: int):
         """
@@ -32,7 +38,8 @@ class Node(object):
         :param frame: frame to send
         :param port_out: egress port
         """
-        self.env.sim_print("%s: %s sending on port %s" % (str(self.address), str(frame), str(port_out)))
+        if self.env.trace_level >= TRACE_ALL:
+            self.env.trace(SENDING, self.address, frame, port_out)
 
     def on_port_added(self, port: int, bandwidth: float, *args):
         """
@@ -49,6 +56,15 @@ class Node(object):
     def get_monitor_results(self):
         pass
 
+    def get_monitor_sketches(self):
+        pass
+
+    def reset_monitor(self):
+        """
+        discards everything monitored so far, e.g. at the end of the warm-up
+        """
+        pass
+
     # called by NetworkEnvironment when Node receives a frame
     def push(self, frame: Frame, port_in: int):
         """
@@ -59,17 +75,22 @@ class Node(object):
         self.on_frame_received(frame, port_in)
 
     # called when Node starts sending a frame on port x
-    # returns timeout_event until frame is completely send [AND an inspector for that event if inspector=True]
-    def pop(self, frame: Frame, port_out: int, extra_bytes: int = 0, inspector: bool = False):
+    # returns timeout_event until frame is completely send [OR a Transmission if preemptable=True]
+    def pop(self, frame: Frame, port_out: int, extra_bytes: int = 0, preemptable: bool = False):
         """
         called when Node starts sending a frame on port x
         :param frame: frame to send
         :param port_out: egress port
         :param extra_bytes: additional bytes to send, this is to increase the sending time without altering the frame
-        :param inspector: true if you want an inspector for the sending event, false otherwise
-        :return: returns a sending_event until the frame is completely send [AND an inspector for that event if inspector=True]
+        :param preemptable: true if the transmission may be paused and resumed, e.g. frame preemption
+        :return: returns a sending_event until the frame is completely send [OR a Transmission if preemptable=True]
         """
-        send_event = self.env.send_frame(frame, self.address, port_out, extra_bytes, inspector)
+        if self.links is not None:
+            link = self.links[port_out]
+            send_event = self.env.transmit(frame, self, link.receiver, link.port_in, link.bandwidth,
+                                           link.physical_delay, extra_bytes, preemptable)
+        else:
+            send_event = self.env.send_frame(frame, self.address, port_out, extra_bytes, preemptable)
         self.on_frame_sending(frame, port_out)
         return send_event
 
@@ -142,7 +163,8 @@ class Flow(Node):
             frame = Frame(self.env, self.address, self.destination, payload, priority)
             # self.env.send_frame(frame, self.address, self.port)
             yield self.pop(frame, port)
-            self.env.sim_print("%s: %s send on port %s" % (str(self.address), str(frame), str(port)))
+            if self.env.trace_level >= TRACE_FRAME:
+                self.env.trace(SEND, self.address, frame, port)
             # sleep_time = np.random.exponential(1.1)
             # yield self.env.timeout(sleep_time)
 
@@ -168,19 +190,22 @@ class SinglePacket(Node):
 
 
 class Flow2(Node):
-    def __init__(self, env, address, frame_generator, monitor=False):
+    def __init__(self, env, address, frame_generator, monitor=False, online=False):
+        """
+        :param online: monitor with constant memory statistics instead of keeping every frame
+        """
         super(Flow2, self).__init__(env, address, monitor)
         self.frame_generator = frame_generator
         self.frames = []
+        init_online_statistics(self, online)
         self.process = env.process(self.run())
 
     def get_monitor_table(self):
-        result = []
-        for frame in self.frames:
-            result += frame.get_hop_table()
-        return result
+        return self.env.hop_log.get_hop_table(self.env, self.frames)
 
     def get_monitor_results(self):
+        if self.online:
+            return online_monitor_results(self)
         self.frames.sort(reverse=True, key=lambda p: p.latency)
         _destination_reached_count = destination_reached_count(self.frames)
         if _destination_reached_count == 0:
@@ -197,9 +222,18 @@ class Flow2(Node):
                    "average_packet_size": _average_packet_size,
                    "standard_deviation_packet_size": _standard_deviation_packet_size,
                    "average_frame_latency": _average_frame_latency,
-                   "standard_deviation_frame_latency": _standard_deviation_latency}
+                   "standard_deviation_frame_latency": _standard_deviation_latency,
+                   "frame_latency_quantiles": get_latency_sketch(self).quantiles(self.env.quantiles)}
         return results
 
+    def get_monitor_sketches(self):
+        return get_latency_sketch(self)
+
+    # frames injected before are not part of the results, even if they arrive later
+    def reset_monitor(self):
+        self.frames = []
+        init_online_statistics(self, self.online)
+
     def run(self):
         while True:
             try:
@@ -208,28 +242,34 @@ class Flow2(Node):
                 self.env.stop()
                 break
             if self.monitor:
-                self.frames.append(frame)
+                if self.online:
+                    record_frame_online(self, frame)
+                else:
+                    record_frame(self, frame)
             yield self.pop(frame, self.ports[0])
 
 
 class FrameInjector(Node):
     def __init__(self, env, address, injection_target_address, bandwidth,
-                 intensity_generator, frame_generator, monitor=False):
+                 intensity_generator, frame_generator, monitor=False, online=False):
+        """
+        :param online: monitor with constant memory statistics instead of keeping every frame
+        """
         super(FrameInjector, self).__init__(env, address, monitor)
         self.injection_target_address = injection_target_address
         self.bandwidth = bandwidth
         self.intensity_generator = intensity_generator
         self.frame_generator = frame_generator
         self.frames = []
+        init_online_statistics(self, online)
         self.process = env.process(self.run())
 
     def get_monitor_table(self):
-        result = []
-        for frame in self.frames:
-            result += frame.get_hop_table()
-        return result
+        return self.env.hop_log.get_hop_table(self.env, self.frames)
 
     def get_monitor_results(self):
+        if self.online:
+            return online_monitor_results(self)
         self.frames.sort(reverse=True, key=lambda p: p.latency)
         _destination_reached_count = destination_reached_count(self.frames)
         if _destination_reached_count == 0:
@@ -246,9 +286,18 @@ class FrameInjector(Node):
                    "average_packet_size": _average_packet_size,
                    "standard_deviation_packet_size": _standard_deviation_packet_size,
                    "average_frame_latency": _average_frame_latency,
-                   "standard_deviation_frame_latency": _standard_deviation_latency}
+                   "standard_deviation_frame_latency": _standard_deviation_latency,
+                   "frame_latency_quantiles": get_latency_sketch(self).quantiles(self.env.quantiles)}
         return results
 
+    def get_monitor_sketches(self):
+        return get_latency_sketch(self)
+
+    # frames injected before are not part of the results, even if they arrive later
+    def reset_monitor(self):
+        self.frames = []
+        init_online_statistics(self, self.online)
+
     def run(self):
         injection_node = self.env.nodes[self.injection_target_address]
         while True:
@@ -258,13 +307,120 @@ class FrameInjector(Node):
                 self.env.stop()
                 break
             if self.monitor:
-                self.frames.append(frame)
+                if self.online:
+                    record_frame_online(self, frame)
+                else:
+                    record_frame(self, frame)
             injection_node.push(frame, "injected")
             sleep_factor = self.intensity_generator.__next__()
-            sending_time = frame.__len__() * 8 / self.bandwidth
+            sending_time = frame.length * 8 / self.bandwidth
             yield self.env.timeout(sleep_factor * sending_time)
 
 
+class ReplayInjector(FrameInjector):
+    def __init__(self, env, address, injection_target_address, file_name, sources=None, monitor=False,
+                 online=False, monitored=True, header=(26, "Ethernet_Frame_Header"), block_size=4096):
+        """
+        replays a trace written by simulation.replay.TraceRecorder, no random numbers are drawn
+        :param injection_target_address: frames are pushed to this node like FrameInjector does,
+        None = frames are send on the first port of this node like Flow2 does
+        :param file_name: trace file
+        :param sources: list of source addresses to replay, None = every frame of the trace
+        :param monitored: replay MonitoredFrames instead of Frames
+        :param header: header of the replayed frames, the payload is the recorded size minus the header size
+        :param block_size: number of records read from the trace at once
+        """
+        self.file_name = file_name
+        self.sources = sources
+        self.monitored = monitored
+        self.header = header
+        self.block_size = block_size
+        super(ReplayInjector, self).__init__(env, address, injection_target_address, None, None, None,
+                                             monitor, online)
+
+    def run(self):
+        records, addresses = read_trace(self.file_name)
+        injection_node = None
+        if self.injection_target_address is not None:
+            injection_node = self.env.nodes[self.injection_target_address]
+        source_indices = None
+        if self.sources is not None:
+            source_indices = [index for index, address in enumerate(addresses) if address in self.sources]
+        frame_type = MonitoredFrame if self.monitored else Frame
+        header_size = self.header[0]
+        for start in range(0, records.__len__(), self.block_size):
+            block = records[start:start + self.block_size]
+            if source_indices is not None:
+                block = block[np.isin(block["source"], source_indices)]
+            for time, source, destination, size, priority in zip(
+                    block["time"].tolist(), block["source"].tolist(), block["destination"].tolist(),
+                    block["size"].tolist(), block["priority"].tolist()):
+                if time > self.env.now:
+                    yield self.env.timeout(time - self.env.now)
+                frame = frame_type(self.env, addresses[source], addresses[destination], size - header_size,
+                                   priority, self.header)
+                if self.monitor:
+                    if self.online:
+                        record_frame_online(self, frame)
+                    else:
+                        record_frame(self, frame)
+                if injection_node is not None:
+                    injection_node.push(frame, "injected")
+                else:
+                    yield self.pop(frame, self.ports[0])
+
+
+# online statistics for nodes which inject MonitoredFrames
+def init_online_statistics(node, online):
+    node.online = online
+    node.frames_injected = 0
+    node.packet_size = RunningStatistics()
+    node.latency = RunningStatistics()
+    node.latency_sketch = QuantileSketch(node.env.quantile_relative_accuracy)
+    # shared by all frames of node
+    node.latency_statistics = (node.latency, node.latency_sketch)
+
+
+# online nodes have no monitor table, the hops of their frames are not logged
+def record_frame_online(node, frame):
+    node.frames_injected += 1
+    node.packet_size.add(frame.__len__())
+    frame.latency_statistics = node.latency_statistics
+
+
+# keeps frame for the monitor table of node, its hops are logged from now on
+def record_frame(node, frame):
+    node.frames.append(frame)
+    frame.on_recorded()
+
+
+# QuantileSketch of the end-to-end latency of the frames injected by node
+def get_latency_sketch(node):
+    if node.online:
+        return node.latency_sketch
+    sketch = QuantileSketch(node.env.quantile_relative_accuracy)
+    for frame in node.frames:
+        if frame.latency >= 0:
+            sketch.add(frame.latency)
+    return sketch
+
+
+def online_monitor_results(node):
+    if node.latency.count == 0:
+        _average_frame_latency = -1
+        _standard_deviation_latency = -1
+    else:
+        _average_frame_latency = node.latency.mean
+        _standard_deviation_latency = node.latency.standard_deviation()
+    return {"frames_injected": node.frames_injected,
+            "frames_destination_reached": node.latency.count,
+            "average_packet_size": node.packet_size.mean,
+            "standard_deviation_packet_size": node.packet_size.standard_deviation(),
+            "average_frame_latency": _average_frame_latency,
+            "standard_deviation_frame_latency": _standard_deviation_latency,
+            "frame_latency_quantiles": node.latency_sketch.quantiles(node.env.quantiles)}
+
+
 def average_packet_size(frames):
     average_frame_length = 0
     frame_count = frames.__len__()
@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+
+from simulation.export import npy_header
+
+# one fixed width record per frame, ordered by time. source and destination are indices into the addresses of
+# the trace, size is the frame length in Bytes including its header
+TRACE_DTYPE = np.dtype([("time", "<f8"), ("source", "<i4"), ("destination", "<i4"), ("size", "<f8"),
+                        ("priority", "<i4")])
+TRACE_HEADER_SIZE = 256
+
+
+class TraceRecorder(object):
+    def __init__(self, file_name, block_size: int = 4096):
+        """
+        writes the frames of generator driven sources to a trace file which can be replayed by ReplayInjector.
+        the file is a .npy file of TRACE_DTYPE records, the addresses are written to <file_name>.json
+        :param file_name: trace file
+        :param block_size: number of records buffered in memory
+        """
+        self.file_name = file_name
+        self.block_size = block_size
+        self.records = []
+        self.length = 0
+        self.addresses = []
+        self.address_index = {}
+        self.file = open(file_name, "wb")
+        self.file.write(npy_header(TRACE_DTYPE, 0, TRACE_HEADER_SIZE))
+
+    def get_address_index(self, address):
+        try:
+            return self.address_index[address]
+        except KeyError:
+            self.address_index[address] = self.addresses.__len__()
+            self.addresses.append(address)
+            return self.addresses.__len__() - 1
+
+    def append(self, time, frame):
+        """
+        :param time: sim_time the frame is injected or send
+        :param frame: frame to record
+        """
+        self.records.append((time, self.get_address_index(frame.source), self.get_address_index(frame.destination),
+                             frame.length, frame.priority))
+        if self.records.__len__() >= self.block_size:
+            self.flush()
+
+    def record(self, env, frame_generator):
+        """
+        wraps the frame_generator of a source (FrameInjector, Flow2, ..), every frame is recorded with the time
+        the source takes it from frame_generator
+        :param env: NetworkEnvironment of the source
+        :param frame_generator: generator which produces frames
+        :return: generator which produces the same frames
+        """
+        for frame in frame_generator:
+            self.append(env.now, frame)
+            yield frame
+
+    def flush(self):
+        if self.records.__len__() == 0:
+            return
+        self.file.write(np.array(self.records, dtype=TRACE_DTYPE).tobytes())
+        self.length += self.records.__len__()
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header(TRACE_DTYPE, self.length, TRACE_HEADER_SIZE))
+        self.file.close()
+        with open("%s.json" % self.file_name, "w", encoding="utf-8") as file:
+            json.dump({"length": self.length, "addresses": self.addresses}, file)
+
+
+def read_trace(file_name):
+    """
+    :param file_name: trace file written by TraceRecorder
+    :return: (memory mapped array of TRACE_DTYPE records, list of addresses)
+    """
+    with open("%s.json" % file_name, "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    # an empty file can not be mapped
+    records = np.load(file_name, mmap_mode="r" if meta["length"] > 0 else None)
+    return records, meta["addresses"]
@@ -0,0 +1,208 @@
+"""
+a scenario is plain data (dict, e.g. loaded from json) which describes a NetworkEnvironment:
+{"name": "Test",
+ "environment": { keyword arguments of NetworkEnvironment except name and seed, verbose defaults to false },
+ "port_params": { name: port param },
+ "nodes": [ node, .. ],
+ "links": [ {"nodes": [address_a, address_b], "bandwidth": 10, "channel_type": null, "length": 0,
+             "port_params": [ name or port param, up to two, see NetworkBuilder.connect_nodes ]}, .. ],
+ "topology": topology,
+ "forwarding_tables": false, "spanning_tree": true, "freeze": true}
+
+port param = {"traffic_classes": 8, "priority": {priority: traffic class},
+              "tsa": {traffic class: "strict_priority" | "credit_based_shaper"},
+              "bandwidth": {traffic class: 0-1}, "queue": {traffic class: "fifo" | "indexed_fifo"}}
+
+node = {"type": "switch", "address": .., "monitor": false, "online": false, "preemption": false,
+        "wake_idle_only": false}
+     | {"type": "sink", "address": ..}
+     | {"type": "single_packet", "address": .., "destination": .., "payload": .., "wait_until": .., "priority": 7}
+     | {"type": "flow2", "address": .., "frames": frames, "monitor": false, "online": false}
+     | {"type": "frame_injector", "address": .., "target": .., "bandwidth": .., "intensity": variate,
+        "frames": frames, "monitor": false, "online": false}
+     | {"type": "replay", "address": .., "target": .. or null, "file_name": .., "sources": null, "monitor": false,
+        "online": false}
+
+frames = {"destination": .., "priority": 0, "monitored": true, "source": address of the node,
+          "payload": variate} or "size": size instead of "payload"
+variate = {"distribution": "exponential", "intensity": ..} | {"distribution": "uniform", "a": .., "b": ..}
+        | {"distribution": "normal", "mean": .., "standard_deviation": ..}
+        | {"distribution": "pareto", "shape": .., "scale": 1} | {"distribution": "constant", "value": ..}
+topology = {"type": "line" | "ring" | "star" | "leaf_spine" | "fat_tree", arguments of the topology function,
+            "switch": { switch node options }, "port_params": name or port param, "channel_type": null}
+           switches and sink hosts are created before the nodes, see simulation.topology for their addresses
+size = {"imix": "simple" | "tolly"} | {"sizes": [..], "weights": [..]} | {"sizes": [..], "cumulative": [..]}
+       frame sizes include the header
+
+every variate and size gets its own RandomState (see generators.stream_random), numbered in the order of the
+nodes, so a scenario and a seed always give the same simulation. the topology is frozen after building, see
+NetworkBuilder.freeze. broadcasts follow a spanning tree unless "spanning_tree" is false, see
+NetworkBuilder.build_spanning_tree
+"""
+
+import json
+from time import perf_counter
+
+from simulation.cache import FileInput
+from simulation.core import NetworkEnvironment
+from simulation.frame import Frame, MonitoredFrame
+from simulation.node import Sink, SinglePacket, Flow2, FrameInjector, ReplayInjector
+from simulation.switch import Switch, SwitchPortParam, TransmissionSelectionAlgorithmMap, FrameQueueMap
+from simulation.topology import TOPOLOGIES, build_topology
+from simulation.generators import stream_random, exp_block_generator, uniform_block_generator, \
+    normal_block_generator, pareto_block_generator, static_block_generator, SizeDistribution, SIMPLE_IMIX, \
+    TOLLY_IMIX, size_distribution_frame_generator
+
+IMIX = {"simple": SIMPLE_IMIX, "tolly": TOLLY_IMIX}
+
+
+def load_scenario(file_name):
+    with open(file_name, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+class ScenarioFactory(object):
+    def __init__(self, scenario):
+        """
+        picklable simulation_factory for the parallel wrappers, seed -> NetworkEnvironment of scenario
+        :param scenario: scenario dict, see simulation.scenario
+        """
+        self.scenario = scenario
+
+    def __call__(self, seed=None):
+        return build_scenario(self.scenario, seed)
+
+    def __repr__(self):
+        return "ScenarioFactory(%s)" % json.dumps(self.scenario, sort_keys=True, default=str)
+
+    # the cache key of a ScenarioFactory is its scenario and the content of the replayed trace files
+    def describe(self):
+        trace_files = [node["file_name"] for node in self.scenario.get("nodes", []) if node.get("type") == "replay"]
+        return {"scenario": self.scenario,
+                "files": [FileInput(file_name) for trace_file in trace_files
+                          for file_name in (trace_file, "%s.json" % trace_file)]}
+
+
+def build_scenario(scenario, seed=None):
+    """
+    :param scenario: scenario dict, see simulation.scenario
+    :param seed: seed of the NetworkEnvironment
+    :return: NetworkEnvironment, its build_time is the time in seconds building it took
+    """
+    start_time = perf_counter()
+    environment = dict(scenario.get("environment", {}))
+    environment.setdefault("verbose", False)
+    env = NetworkEnvironment(scenario.get("name", "no_name"), seed, **environment)
+    builder = env.builder
+    streams = iter(range(0, 1 << 31))
+    port_params = scenario.get("port_params", {})
+    if "topology" in scenario:
+        build_scenario_topology(env, scenario["topology"], port_params)
+    builder.append_nodes(*[build_node(env, node, streams) for node in scenario.get("nodes", [])])
+    for link in scenario.get("links", []):
+        node_a, node_b = [env.nodes[address] for address in link["nodes"]]
+        switch_params = [build_port_param(port_params[param] if isinstance(param, str) else param)
+                         for param in link.get("port_params", [])]
+        builder.connect_nodes(node_a, node_b, link.get("bandwidth", 10), link.get("channel_type"),
+                              link.get("length", 0), *switch_params)
+    if scenario.get("forwarding_tables", False):
+        builder.build_forwarding_tables()
+    if scenario.get("spanning_tree", True):
+        builder.build_spanning_tree()
+    if scenario.get("freeze", True):
+        builder.freeze()
+    env.build_time = perf_counter() - start_time
+    return env
+
+
+def build_scenario_topology(env, topology, port_params):
+    arguments = {key: value for key, value in topology.items()
+                 if key not in ("type", "switch", "port_params", "channel_type")}
+    switch = dict(topology.get("switch", {}), type="switch")
+    param = topology.get("port_params")
+    switch_param = build_port_param(port_params[param] if isinstance(param, str) else param) \
+        if param is not None else None
+    build_topology(env, TOPOLOGIES[topology["type"]](**arguments),
+                   lambda env, address: build_node(env, dict(switch, address=address), None), None, switch_param,
+                   topology.get("channel_type"))
+
+
+def build_port_param(param):
+    switch_param = SwitchPortParam(param.get("traffic_classes", 8))
+    for priority, traffic_class in param.get("priority", {}).items():
+        switch_param.priority_map.map_priority_traffic_class(int(priority), traffic_class)
+    for traffic_class, tsa in param.get("tsa", {}).items():
+        switch_param.tsa_map.map_traffic_class_transmission_selection_algorithm(
+            int(traffic_class), getattr(TransmissionSelectionAlgorithmMap, tsa))
+    for traffic_class, delta_bandwidth in param.get("bandwidth", {}).items():
+        switch_param.tsa_bandwidth.map_traffic_class_bandwidth(int(traffic_class), delta_bandwidth)
+    for traffic_class, queue in param.get("queue", {}).items():
+        switch_param.queue_map.map_traffic_class_frame_queue(int(traffic_class), getattr(FrameQueueMap, queue))
+    return switch_param
+
+
+def build_node(env, node, streams):
+    node_type = node["type"]
+    address = node["address"]
+    if node_type == "switch":
+        return Switch(env, address, monitor=node.get("monitor", False), preemption=node.get("preemption", False),
+                      wake_idle_only=node.get("wake_idle_only", False), online=node.get("online", False))
+    if node_type == "sink":
+        return Sink(env, address)
+    if node_type == "single_packet":
+        return SinglePacket(env, address, node["destination"], node["payload"], node["wait_until"],
+                            node.get("priority", 7))
+    if node_type == "flow2":
+        return Flow2(env, address, build_frame_generator(env, address, node["frames"], streams),
+                     node.get("monitor", False), node.get("online", False))
+    if node_type == "frame_injector":
+        return FrameInjector(env, address, node["target"], node["bandwidth"],
+                             build_variate_generator(env, node["intensity"], next(streams)),
+                             build_frame_generator(env, address, node["frames"], streams),
+                             node.get("monitor", False), node.get("online", False))
+    if node_type == "replay":
+        return ReplayInjector(env, address, node.get("target"), node["file_name"], node.get("sources"),
+                              node.get("monitor", False), node.get("online", False))
+    raise ValueError("unknown node type %s" % str(node_type))
+
+
+def build_variate_generator(env, variate, stream):
+    random = stream_random(env, stream)
+    distribution = variate["distribution"]
+    if distribution == "exponential":
+        return exp_block_generator(env, variate["intensity"], random)
+    if distribution == "uniform":
+        return uniform_block_generator(env, variate.get("a", 0.0), variate.get("b", 1.0), random)
+    if distribution == "normal":
+        return normal_block_generator(env, variate.get("mean", 0.0), variate.get("standard_deviation", 1.0), random)
+    if distribution == "pareto":
+        return pareto_block_generator(env, variate["shape"], variate.get("scale", 1.0), random)
+    if distribution == "constant":
+        return static_block_generator(variate["value"])
+    raise ValueError("unknown distribution %s" % str(distribution))
+
+
+def build_size_distribution(size):
+    if "imix" in size:
+        return IMIX[size["imix"]]
+    if "cumulative" in size:
+        return SizeDistribution.from_cdf(size["sizes"], size["cumulative"])
+    return SizeDistribution(size["sizes"], size["weights"])
+
+
+def build_frame_generator(env, address, frames, streams):
+    source = frames.get("source", address)
+    monitored = frames.get("monitored", True)
+    priority = frames.get("priority", 0)
+    if "size" in frames:
+        return size_distribution_frame_generator(env, source, frames["destination"],
+                                                 build_size_distribution(frames["size"]), priority, monitored,
+                                                 stream_random(env, next(streams)))
+    payload_generator = build_variate_generator(env, frames["payload"], next(streams))
+    return payload_frame_generator(env, source, frames["destination"], payload_generator, priority, monitored)
+
+
+def payload_frame_generator(env, source, destination, payload_generator, priority=0, monitored=True):
+    frame_type = MonitoredFrame if monitored else Frame
+    for payload in payload_generator:
+        yield frame_type(env, source, destination, payload, priority)
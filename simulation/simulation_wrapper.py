@@ -1,13 +1,19 @@
-from math import sqrt
-from scipy import stats
+from math import sqrt, ceil, inf, isnan
+from time import time, perf_counter
 from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+import numpy as np
 import csv
 
+from simulation.statistics import QuantileSketch
+from simulation.export import ColumnarExporter
 
-def simulate_multiple(simulation_generator_list, count, runtime, confidence_coefficient):
+
+def simulate_multiple(simulation_generator_list, count, runtime, confidence_coefficient, warmup=None):
     results = {}
     for simulation_generator in simulation_generator_list:
-        results.update(simulate_same_multiple(simulation_generator, count, runtime, confidence_coefficient))
+        results.update(simulate_same_multiple(simulation_generator, count, runtime, confidence_coefficient,
+                                              warmup=warmup))
     return results
 
 
@@ -45,18 +51,391 @@ def simulate_same_multiple_csv(simulation_generator, count, runtime, file_name=N
     return result
 
 
-def simulate_same_multiple(simulation_generator, count, runtime, confidence_coefficient, return_singles=False):
+# streams the monitor tables of all replications to path while they run instead of collecting them in memory,
+# see simulation.export.read_table. use online monitoring as well to keep the memory of a replication constant
+def simulate_same_multiple_export(simulation_generator, count, runtime, path, chunk_size=65536, parquet=False):
+    return simulate_multiple_export([simulation_generator], count, runtime, path, chunk_size, parquet)
+
+
+def simulate_multiple_export(simulation_generator_list, count, runtime, path, chunk_size=65536, parquet=False):
+    exporter = ColumnarExporter(path, chunk_size, parquet)
+    try:
+        for simulation_generator in simulation_generator_list:
+            for i in range(0, count):
+                sim_env = simulation_generator.__next__()
+                sim_env.exporter = exporter
+                sim_env.run(runtime)
+    finally:
+        exporter.close()
+    return path
+
+
+# quantiles: if given, the QuantileSketches of all replications are merged and these quantiles are returned
+# as "merged_quantiles"
+# warmup: see NetworkEnvironment.run, a sim_time or "mser"
+def simulate_same_multiple(simulation_generator, count, runtime, confidence_coefficient, return_singles=False,
+                           quantiles=None, warmup=None):
     simulation_results = []
+    simulation_sketches = []
     name = "empty"
     for i in range(0, count):
             sim_env = simulation_generator.__next__()
             name = sim_env.name
-            sim_env.run(runtime)
+            sim_env.run(runtime, warmup)
             simulation_results.append(sim_env.get_monitor_results())
+            if quantiles is not None:
+                simulation_sketches.append(sim_env.get_monitor_sketches())
+    return {name: combine_results(simulation_results, simulation_sketches, confidence_coefficient, return_singles,
+                                  quantiles)}
+
+
+def combine_results(simulation_results, simulation_sketches, confidence_coefficient, return_singles=False,
+                    quantiles=None):
+    """
+    :param simulation_results: list of get_monitor_results of all replications
+    :param simulation_sketches: list of get_monitor_sketches of all replications
+    :param confidence_coefficient: see get_confidence_interval
+    :param return_singles: see simulate_same_multiple
+    :param quantiles: see simulate_same_multiple
+    :return: result of one simulation for simulate_same_multiple
+    """
     result = get_confidence_interval(simulation_results, confidence_coefficient)
-    if not return_singles:
-        return {name: result}
-    return {name: {"combined_result": result, "single_results": simulation_results}}
+    if not return_singles and quantiles is None:
+        return result
+    combined = {"combined_result": result}
+    if return_singles:
+        combined["single_results"] = simulation_results
+    if quantiles is not None:
+        combined["merged_quantiles"] = get_quantiles(merge_sketches(simulation_sketches), quantiles)
+    return combined
+
+
+def merge_sketches(list_of_dicts):
+    """
+    merges the QuantileSketches of several replications
+    :param list_of_dicts: list of get_monitor_sketches
+    :return: dict of merged QuantileSketches
+    """
+    result = {}
+    for key, value in list_of_dicts[0].items():
+        if isinstance(value, dict):
+            result[key] = merge_sketches([_dict[key] for _dict in list_of_dicts])
+        else:
+            result[key] = QuantileSketch(value.relative_accuracy)
+            for _dict in list_of_dicts:
+                result[key].merge(_dict[key])
+    return result
+
+
+def get_quantiles(sketches, quantiles):
+    result = {}
+    for key, value in sketches.items():
+        if isinstance(value, dict):
+            result[key] = get_quantiles(value, quantiles)
+        else:
+            result[key] = value.quantiles(quantiles)
+    return result
+
+
+def replication_seeds(master_seed, count):
+    """
+    spawns independent and reproducible seeds for count replications from one master seed
+    :param master_seed: int, None draws fresh entropy from the operating system
+    :param count: number of replications
+    :return: list of ints, usable as NetworkEnvironment seed
+    """
+    return [int(seed_sequence.generate_state(1)[0])
+            for seed_sequence in np.random.SeedSequence(master_seed).spawn(count)]
+
+
+# executed in a worker process, job = (simulation_factory, seed, runtime, tables, warmup)
+def run_replication(job):
+    simulation_factory, seed, runtime, tables, warmup = job
+    build_start_time = perf_counter()
+    sim_env = simulation_factory(seed)
+    build_time = perf_counter() - build_start_time
+    sim_env.run(runtime, warmup)
+    if tables:
+        return sim_env.name, dict(sim_env.get_monitor_tables()), None, build_time
+    return sim_env.name, sim_env.get_monitor_results(), sim_env.get_monitor_sketches(), build_time
+
+
+def run_replications(jobs, workers=None, pool=None, cache=None):
+    """
+    runs all jobs and returns their results in the order of jobs, no matter how many workers are used
+    :param jobs: list of (simulation_factory, seed, runtime, tables, warmup)
+    :param workers: size of the process pool, None = cpu count, 1 = run in this process
+    :param pool: Pool to use instead of starting a new one
+    :param cache: ResultCache, only jobs without a cached result are run. every result is stored as soon as it is
+    done, so an interrupted sweep only loses the running replications
+    :return: list of (sim_name, result, sketches, seconds the simulation_factory took to build the environment)
+    """
+    if cache is None:
+        return list(iterate_replications(jobs, workers, pool))
+    keys = [cache.key(*job) for job in jobs]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(missing, iterate_replications([jobs[i] for i in missing], workers, pool)):
+        cache.put(keys[i], result)
+        results[i] = result
+    cache.evict()
+    return results
+
+
+# yields the results of jobs in the order of jobs while they are done
+def iterate_replications(jobs, workers=None, pool=None):
+    if pool is not None:
+        yield from pool.imap(run_replication, jobs, chunksize=1)
+    elif workers == 1 or jobs.__len__() <= 1:
+        for job in jobs:
+            yield run_replication(job)
+    else:
+        with Pool(workers) as pool:
+            yield from pool.imap(run_replication, jobs, chunksize=1)
+
+
+# simulation_factory: picklable callable (module level function, functools.partial) which takes a seed and
+# returns a freshly wired NetworkEnvironment. every simulation_factory gets the same seeds (common random numbers)
+def simulate_same_multiple_parallel(simulation_factory, count, runtime, confidence_coefficient, master_seed=None,
+                                    workers=None, return_singles=False, quantiles=None, warmup=None, cache=None,
+                                    build_times=None):
+    return simulate_multiple_parallel([simulation_factory], count, runtime, confidence_coefficient, master_seed,
+                                      workers, return_singles, quantiles, warmup, cache, build_times)
+
+
+def simulate_multiple_parallel(simulation_factory_list, count, runtime, confidence_coefficient, master_seed=None,
+                               workers=None, return_singles=False, quantiles=None, warmup=None, cache=None,
+                               build_times=None):
+    """
+    parallel version of simulate_multiple, all replications of all simulations share one process pool
+    :param simulation_factory_list: list of callables seed -> NetworkEnvironment
+    :param count: replications per simulation
+    :param runtime: runtime of each replication
+    :param confidence_coefficient: see get_confidence_interval
+    :param master_seed: seed the replication seeds are spawned from
+    :param workers: size of the process pool, None = cpu count, 1 = serial
+    :param return_singles: see simulate_same_multiple
+    :param quantiles: see simulate_same_multiple
+    :param warmup: see simulate_same_multiple
+    :param cache: ResultCache, replications which have been run before are taken from it, see run_replications
+    :param build_times: list, the seconds every replication took to build its environment are appended to it.
+    cached replications report the build time of the run they were cached from
+    :return: same as simulate_multiple
+    """
+    seeds = replication_seeds(master_seed, count)
+    jobs = [(simulation_factory, seed, runtime, False, warmup)
+            for simulation_factory in simulation_factory_list for seed in seeds]
+    replications = run_replications(jobs, workers, cache=cache)
+    if build_times is not None:
+        build_times += [replication[3] for replication in replications]
+    results = {}
+    for i in range(0, simulation_factory_list.__len__()):
+        simulation_replications = replications[i * count:(i + 1) * count]
+        name = simulation_replications[0][0]
+        simulation_results = [replication[1] for replication in simulation_replications]
+        simulation_sketches = [replication[2] for replication in simulation_replications]
+        results[name] = combine_results(simulation_results, simulation_sketches, confidence_coefficient,
+                                        return_singles, quantiles)
+    return results
+
+
+def simulate_same_multiple_sequential(simulation_factory, runtime, confidence_coefficient, relative_half_width=0.05,
+                                      metrics=None, min_count=5, max_count=100, time_budget=None, master_seed=None,
+                                      workers=None, return_singles=False, quantiles=None, warmup=None, cache=None,
+                                      build_times=None):
+    return simulate_multiple_sequential([simulation_factory], runtime, confidence_coefficient, relative_half_width,
+                                        metrics, min_count, max_count, time_budget, master_seed, workers,
+                                        return_singles, quantiles, warmup, cache, build_times)
+
+
+def simulate_multiple_sequential(simulation_factory_list, runtime, confidence_coefficient, relative_half_width=0.05,
+                                 metrics=None, min_count=5, max_count=100, time_budget=None, master_seed=None,
+                                 workers=None, return_singles=False, quantiles=None, warmup=None, cache=None,
+                                 build_times=None):
+    """
+    runs replications of every simulation until the confidence interval of every selected metric is narrow enough.
+    the simulations are run in rounds, every round runs more replications of all simulations which have not
+    converged yet in one process pool
+    :param simulation_factory_list: list of callables seed -> NetworkEnvironment
+    :param runtime: runtime of each replication
+    :param confidence_coefficient: see get_confidence_interval
+    :param relative_half_width: a metric has converged if (upper - lower) / 2 <= relative_half_width * |average|
+    :param metrics: list of metrics to check, None = all. a metric is a tuple of keys, every result below it is
+    checked (e.g. ("Switch", 1, "average_waiting_time")), or a single key which may appear anywhere
+    (e.g. "average_frame_latency")
+    :param min_count: replications before the first check, at least 2
+    :param max_count: maximum replications per simulation
+    :param time_budget: seconds after which no new round is started, None = no limit. it is checked between rounds,
+    a round which started before the budget was used up runs to its end, so the call may take up to one round longer
+    :param master_seed: see replication_seeds, replication i of every simulation gets the same seed
+    :param workers: size of the process pool, None = cpu count, 1 = serial
+    :param return_singles: see simulate_same_multiple
+    :param quantiles: see simulate_same_multiple
+    :param warmup: see simulate_same_multiple
+    :param cache: see simulate_multiple_parallel
+    :param build_times: see simulate_multiple_parallel
+    :return: { sim_name: {"combined_result": .., "replications": number of replications,
+    "converged": bool, "relative_half_width": largest relative half width of the selected metrics, ..} }
+    """
+    start_time = time()
+    min_count = max(min_count, 2)
+    seeds = replication_seeds(master_seed, max_count)
+    replications = [[] for simulation_factory in simulation_factory_list]
+    converged = [False for simulation_factory in simulation_factory_list]
+    half_widths = [inf for simulation_factory in simulation_factory_list]
+    pool = Pool(workers) if workers != 1 else None
+    try:
+        while True:
+            running = [i for i in range(0, simulation_factory_list.__len__())
+                       if not converged[i] and replications[i].__len__() < max_count]
+            if running.__len__() == 0 or (time_budget is not None and time() - start_time >= time_budget):
+                break
+            # keep the pool busy, split it among the simulations which have not converged
+            step = max(1, ceil((workers or cpu_count()) / running.__len__()))
+            jobs = []
+            counts = []
+            for i in running:
+                done = replications[i].__len__()
+                count = min(max(min_count - done, step), max_count - done)
+                jobs += [(simulation_factory_list[i], seed, runtime, False, warmup)
+                         for seed in seeds[done:done + count]]
+                counts.append(count)
+            results = run_replications(jobs, 1, pool, cache)
+            if build_times is not None:
+                build_times += [replication[3] for replication in results]
+            for i, count in zip(running, counts):
+                replications[i] += results[:count]
+                results = results[count:]
+                simulation_results = [replication[1] for replication in replications[i]]
+                half_widths[i] = float(max_relative_half_width(
+                    get_confidence_interval(simulation_results, confidence_coefficient), metrics))
+                converged[i] = bool(half_widths[i] <= relative_half_width)
+    finally:
+        # all results have been collected unless a replication raised, then the other workers are stopped
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    results = {}
+    for i, simulation_replications in enumerate(replications):
+        name = simulation_replications[0][0]
+        simulation_results = [replication[1] for replication in simulation_replications]
+        simulation_sketches = [replication[2] for replication in simulation_replications]
+        result = combine_results(simulation_results, simulation_sketches, confidence_coefficient, return_singles,
+                                 quantiles)
+        if not isinstance(result, dict) or "combined_result" not in result:
+            result = {"combined_result": result}
+        result["replications"] = simulation_replications.__len__()
+        result["converged"] = converged[i]
+        result["relative_half_width"] = half_widths[i]
+        results[name] = result
+    return results
+
+
+def max_relative_half_width(confidence_interval, metrics=None, path=()):
+    """
+    :param confidence_interval: result of get_confidence_interval
+    :param metrics: see simulate_multiple_sequential
+    :return: largest (upper - lower) / 2 / |average| of the selected metrics, 0 if average and width are 0
+    """
+    result = 0
+    for key, value in confidence_interval.items():
+        key_path = path + (key,)
+        if "average" not in value or isinstance(value["average"], dict):
+            result = max(result, max_relative_half_width(value, metrics, key_path))
+        elif metrics is None or any(key_path[:metric.__len__()] == metric if isinstance(metric, tuple)
+                                    else metric in key_path for metric in metrics):
+            half_width = (value["upper"] - value["lower"]) / 2
+            if isnan(half_width):
+                return inf
+            if half_width != 0:
+                result = max(result, half_width / abs(value["average"]) if value["average"] != 0 else inf)
+    return result
+
+
+def simulate_same_multiple_csv_parallel(simulation_factory, count, runtime, file_name=None, master_seed=None,
+                                        workers=None, cache=None):
+    return simulate_multiple_csv_parallel([simulation_factory], count, runtime, file_name, master_seed, workers,
+                                          cache)
+
+
+def simulate_multiple_csv_parallel(simulation_factory_list, count, runtime, file_name=None, master_seed=None,
+                                   workers=None, cache=None):
+    seeds = replication_seeds(master_seed, count)
+    jobs = [(simulation_factory, seed, runtime, True, None)
+            for simulation_factory in simulation_factory_list for seed in seeds]
+    result = defaultdict(list)
+    for name, result_tables, sketches, build_time in run_replications(jobs, workers, cache=cache):
+        for key, table in result_tables.items():
+            result[key] += table
+    if file_name is not None:
+        write_csv(file_name, result)
+    return result
+
+
+def simulate_batch_means(simulation_generator, batch_count, batch_length, confidence_coefficient, warmup=None,
+                         return_singles=False, autocorrelation_threshold=0.2):
+    """
+    confidence intervals from one long run instead of independent replications. the run is split into batch_count
+    non overlapping batches of batch_length, the monitors are reset at the start of every batch so the results of a
+    batch only cover this batch (see NetworkEnvironment.reset_monitors). frames which are injected in one batch and
+    arrive in the next one are not part of any batch
+    :param simulation_generator: generator which yields the NetworkEnvironment, it is called once
+    :param batch_count: number of batches, the run takes warmup + batch_count * batch_length
+    :param batch_length: sim_time of one batch
+    :param confidence_coefficient: see get_confidence_interval
+    :param warmup: see NetworkEnvironment.run, the first batch starts after the warm-up
+    :param return_singles: return the results of every batch as "single_results"
+    :param autocorrelation_threshold: the batches are "independent" if the lag 1 autocorrelation of the batch
+    results is at most this for every metric, otherwise batch_length is too short
+    :return: { sim_name: {"combined_result": same as get_confidence_interval, "batches": batch_count,
+    "lag1_autocorrelation": lag 1 autocorrelation per metric, "max_lag1_autocorrelation": .., "independent": bool} }
+    """
+    sim_env = simulation_generator.__next__()
+    if warmup == "mser":
+        sim_env.run_warmup(sim_env.now + batch_count * batch_length)
+    elif warmup is not None:
+        sim_env.run(warmup)
+    sim_env.reset_monitors()
+    batch_results = []
+    for i in range(0, batch_count):
+        sim_env.run(sim_env.now + batch_length)
+        batch_results.append(sim_env.get_monitor_results())
+        sim_env.reset_monitors()
+    autocorrelation = lag1_autocorrelation(batch_results)
+    # only a positive autocorrelation makes the confidence intervals too narrow
+    max_autocorrelation = max_value(autocorrelation)
+    result = {"combined_result": get_confidence_interval(batch_results, confidence_coefficient),
+              "batches": batch_count,
+              "lag1_autocorrelation": autocorrelation,
+              "max_lag1_autocorrelation": max_autocorrelation,
+              "independent": max_autocorrelation <= autocorrelation_threshold}
+    if return_singles:
+        result["single_results"] = batch_results
+    return {sim_env.name: result}
+
+
+def lag1_autocorrelation(list_of_dicts):
+    """
+    :param list_of_dicts: results in the order of time, e.g. of consecutive batches
+    :return: lag 1 autocorrelation of every value, 0 if the value is constant
+    """
+    result = {}
+    for key, list_of_values, nested in result_values(list_of_dicts):
+        if nested:
+            result[key] = lag1_autocorrelation(list_of_values)
+        else:
+            values = np.array(list_of_values, dtype=np.float64)
+            deviation = values - values.mean()
+            denominator = np.dot(deviation, deviation)
+            result[key] = float(np.dot(deviation[:-1], deviation[1:]) / denominator) if denominator > 0 else 0.0
+    return result
+
+
+def max_value(_dict):
+    result = -inf
+    for value in _dict.values():
+        result = max(result, max_value(value) if isinstance(value, dict) else value)
+    return result
 
 
 def default_callback(sim_env):
@@ -75,13 +454,28 @@ def simulate_in_steps(simulation_generator, step_count, runtime, callback=defaul
     return sim_env.get_monitor_results()
 
 
+def result_values(list_of_dicts):
+    """
+    yields (key, values, nested) for every key of the results in list_of_dicts. key is nested if its value is a dict
+    in any result, results without a dict there (-1 = no data, e.g. an empty batch) and without key are skipped
+    """
+    keys = {}
+    for _dict in list_of_dicts:
+        for key, value in _dict.items():
+            keys[key] = keys.get(key, False) or isinstance(value, dict)
+    for key, nested in keys.items():
+        if nested:
+            yield key, [_dict[key] for _dict in list_of_dicts if isinstance(_dict.get(key), dict)], nested
+        else:
+            yield key, [_dict[key] for _dict in list_of_dicts if key in _dict], nested
+
+
 def get_confidence_interval(list_of_dicts, confidence_coefficient):
     result = {}
-    for key, value in list_of_dicts[0].items():
-        if isinstance(value, dict):
-            result[key] = get_confidence_interval([_dict[key] for _dict in list_of_dicts], confidence_coefficient)
+    for key, list_of_values, nested in result_values(list_of_dicts):
+        if nested:
+            result[key] = get_confidence_interval(list_of_values, confidence_coefficient)
         else:
-            list_of_values = [_dict[key] for _dict in list_of_dicts]
             _average = average(list_of_values)
             _standard_deviation = standard_deviation(list_of_values, _average)
             quantile = stud_t(confidence_coefficient, list_of_values.__len__() - 1)
@@ -104,10 +498,14 @@ def average(list_of_values):
 
 def standard_deviation(list_of_values, mean):
     result = 0
+    if list_of_values.__len__() < 2:
+        return result
     for value in list_of_values:
         result += pow(value - mean, 2) / (list_of_values.__len__() - 1)
     return sqrt(result)
 
 
+# scipy takes about a second to import, it is only imported when a confidence interval is computed
 def stud_t(confidence_coefficient, degree_of_freedom):
+    from scipy import stats
     return stats.t.ppf(1 - ((1 - confidence_coefficient) / 2), degree_of_freedom)
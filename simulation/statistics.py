@@ -0,0 +1,160 @@
+from math import sqrt, log, ceil
+
+import numpy as np
+
+
+class RunningStatistics(object):
+    def __init__(self):
+        """
+        mean and variance of a series of values in constant memory (Welford's algorithm)
+        """
+        self.count = 0
+        self.mean = 0
+        # sum of squared differences from the mean
+        self.m2 = 0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        return self.m2 / ((self.count - 1) if self.count > 1 else 1)
+
+    def standard_deviation(self):
+        return sqrt(self.variance())
+
+
+class TimeWeightedStatistics(object):
+    def __init__(self, start_time=0):
+        """
+        time weighted mean and standard deviation of a step function, e.g. a queue length, in constant memory
+        :param start_time: sim_time the integration starts at
+        """
+        self.start_time = start_time
+        self.last_time = start_time
+        # integral of value and value² from start_time to last_time
+        self.area = 0
+        self.square_area = 0
+
+    # value = value of the step function since the last update, call before the value changes
+    def update(self, time, value):
+        passed_time = time - self.last_time
+        self.area += passed_time * value
+        self.square_area += passed_time * value * value
+        self.last_time = time
+
+    # runtime = length of the observed time span, the time after the last update does not add to the integrals
+    def mean(self, runtime):
+        return self.area / runtime
+
+    def standard_deviation(self, runtime):
+        mean = self.mean(runtime)
+        # sum of passed_time * (value - mean)² until last_time
+        square_deviation = self.square_area - 2 * mean * self.area + mean * mean * (self.last_time - self.start_time)
+        return sqrt(max(square_deviation, 0) / runtime)
+
+
+class QuantileSketch(object):
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        quantiles of a series of values >= 0 in bounded memory, each quantile is within relative_accuracy of the
+        exact value (DDSketch: logarithmic buckets). sketches with the same relative_accuracy can be merged
+        :param relative_accuracy: 0-1
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = log(self.gamma)
+        # { bucket index: count }, bucket i holds values in (gamma^(i-1), gamma^i]
+        self.bins = {}
+        # values too small for a bucket
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    # values <= min_value are counted in zero_count
+    min_value = 1e-9
+
+    def add(self, value):
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= QuantileSketch.min_value:
+            self.zero_count += 1
+        else:
+            index = ceil(log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        """
+        adds the values of other to this sketch
+        :param other: QuantileSketch with the same relative_accuracy
+        :return: returns this QuantileSketch
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("sketches with different relative accuracy can not be merged")
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        :param q: 0-1
+        :return: value of quantile q, -1 if the sketch is empty
+        """
+        if self.count == 0:
+            return -1
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return self.min
+        count = self.zero_count
+        for index in sorted(self.bins):
+            count += self.bins[index]
+            if count > rank:
+                value = 2 * pow(self.gamma, index) / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        """
+        :param qs: iterable of quantiles 0-1
+        :return: { q: value }
+        """
+        return {q: self.quantile(q) for q in qs}
+
+
+def mser(series, batch_size: int = 5):
+    """
+    warm-up truncation point of series (MSER-m, MSER-5 for batch_size=5). series is split into batches of
+    batch_size observations, d batches are truncated where the standard error of the remaining batch means is minimal.
+    only d in the first half of the batches is considered, a minimum at the end of it means the series is too short
+    :param series: observations in the order of time
+    :param batch_size: observations per batch
+    :return: number of observations to truncate, None if there are less than two batches or the series is too short
+    """
+    batch_count = series.__len__() // batch_size
+    if batch_count < 2:
+        return None
+    means = np.asarray(series[:batch_count * batch_size], dtype=np.float64).reshape(batch_count, batch_size).mean(1)
+    # sums of means[d:] for every d
+    suffix_sum = np.cumsum(means[::-1])[::-1]
+    suffix_square_sum = np.cumsum((means * means)[::-1])[::-1]
+    count = np.arange(batch_count, 0, -1, dtype=np.float64)
+    squared_error = np.maximum(suffix_square_sum - suffix_sum * suffix_sum / count, 0)
+    statistic = squared_error / (count * count)
+    half = batch_count // 2
+    truncated_batches = int(np.argmin(statistic[:half + 1]))
+    # still decreasing at the end of the first half
+    if truncated_batches == half:
+        return None
+    return truncated_batches * batch_size
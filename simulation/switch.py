@@ -1,9 +1,14 @@
 from simpy import Interrupt
 
 from simulation.node import Node
+from simulation.trace import TRACE_FRAME, TRACE_ALL, RECEIVED, SEND, DISCARDED, BROADCASTING, STOPPED, CONTINUED
 from simulation.switch_buffer import SwitchBuffer, StrictPriorityAlgorithm, CreditBasedShaper, \
-    TransmissionSelectionAlgorithm, standard_deviation_waiting_time, average_waiting_time, average_packet_size, \
-    standard_deviation_packet_size, average_queue_length, standard_deviation_queue_length
+    TransmissionSelectionAlgorithm, FrameQueue, FrameFIFO, FrameIndexedFIFO, standard_deviation_waiting_time, \
+    average_waiting_time, average_packet_size, standard_deviation_packet_size, average_queue_length, \
+    standard_deviation_queue_length, online_monitor_results
+
+# µs, wake ups of a port which are closer together than this are treated as the same
+WAKEUP_TOLERANCE = 1e-6
 
 
 class PriorityMap(object):
@@ -37,6 +42,10 @@ class PriorityMap(object):
     def get_traffic_class(self, priority):
         return self.map[self.available_traffic_classes][priority]
 
+    # list priority -> traffic class, changed in place by map_priority_traffic_class
+    def get_traffic_classes(self):
+        return self.map[self.available_traffic_classes]
+
 
 class TransmissionSelectionAlgorithmMap(object):
     strict_priority = StrictPriorityAlgorithm
@@ -62,6 +71,28 @@ class TransmissionSelectionAlgorithmMap(object):
         self.transmission_selection_algorithm_per_traffic_class[traffic_class] = tsa
 
 
+class FrameQueueMap(object):
+    fifo = FrameFIFO
+    indexed_fifo = FrameIndexedFIFO
+
+    def __init__(self, available_traffic_classes: int = 8):
+        """
+        Maps FrameQueue implementations to traffic classes
+        :param available_traffic_classes: how many traffic classes are supported. 1-8
+        """
+        self.frame_queue_per_traffic_class = []
+        for i in range(0, available_traffic_classes):
+            self.frame_queue_per_traffic_class.append(FrameQueueMap.fifo)
+
+    def map_traffic_class_frame_queue(self, traffic_class: int, queue: FrameQueue):
+        """
+        Maps a specific FrameQueue to a specific traffic class
+        :param traffic_class:
+        :param queue: FrameQueue class
+        """
+        self.frame_queue_per_traffic_class[traffic_class] = queue
+
+
 class TrafficClassBandwidthMap(object):
     def __init__(self, available_traffic_classes=8):
         """
@@ -85,25 +116,32 @@ class TrafficClassBandwidthMap(object):
 class SwitchPortParam(object):
     def __init__(self, available_traffic_classes:int = 8):
         """
-        Collection of all 3 Switch specific config-classes
+        Collection of all 4 Switch specific config-classes
         :param available_traffic_classes: how many traffic classes are supported. 1-8
         """
         self.priority_map = PriorityMap(available_traffic_classes)
         self.tsa_map = TransmissionSelectionAlgorithmMap(available_traffic_classes)
         self.tsa_bandwidth = TrafficClassBandwidthMap(available_traffic_classes)
+        self.queue_map = FrameQueueMap(available_traffic_classes)
 
 
 class Switch(Node):
     # aging_time in seconds
-    def __init__(self, env, address, aging_time: int = -1, preemption: bool = False, monitor: bool = False):
+    def __init__(self, env, address, aging_time: int = -1, preemption: bool = False, monitor: bool = False,
+                 wake_idle_only: bool = False, online: bool = False):
         """
         :param env:
         :param address: see Node address
         :param aging_time: time until self learning entry is discarded. Should be ignored
         :param preemption: activate frame preemption for this Switch
         :param monitor: bool
+        :param wake_idle_only: only interrupt idle port processes for new frames. busy ports pick up the next frame
+        when their transmission is done, with preemption they are interrupted for higher traffic classes only
+        :param online: monitor with constant memory statistics. get_monitor_results is then O(ports x classes),
+        get_monitor_table has no rows
         """
         super(Switch, self).__init__(env, address, monitor)
+        self.online = online
         # time until entries in switch_table become invalid, input in seconds -> x1.000.000 for µs
         self.aging_time = aging_time * 1000000 if aging_time > 0 else aging_time
         # activate preemption for this Switch
@@ -115,9 +153,33 @@ class Switch(Node):
         self.port_modules = {}
         # sleeping event if buffer is empty
         self.sleep_event = env.event()
+        self.wake_idle_only = wake_idle_only
+        # { port: bool } True if the process of this port waits on sleep_event
+        self.idle_ports = {}
+        # { port: [time, timeout] } pending wake up of a port process, e.g. when the credit of a
+        # CreditBasedShaper reaches 0 again
+        self.wakeups = {}
+        # { destination: port_out } precomputed by NetworkBuilder.build_forwarding_tables
+        # None -> self learning with switch_table
+        self.forwarding_table = None
+        # (port, ..) ports of the spanning tree computed by NetworkBuilder.build_spanning_tree, frames are only
+        # broadcasted on these. None -> broadcast on all ports
+        self.flood_ports = None
 
     def on_frame_received(self, frame, port_in):
-        self.env.sim_print("%s: %s received on port %s" % (str(self.address), str(frame), str(port_in)))
+        if self.env.trace_level >= TRACE_FRAME:
+            self.env.trace(RECEIVED, self.address, frame, port_in)
+        if self.forwarding_table is not None:
+            # static forwarding, unknown destinations (e.g. "broadcast") are broadcasted
+            port_out = self.forwarding_table.get(frame.destination)
+            if port_out is None:
+                self.broadcast_frame(frame, port_in)
+            elif port_in == port_out:
+                self.on_frame_discard(frame)
+            else:
+                self.port_modules[port_out][0].append_frame(frame)
+                self.signal_port(port_out, frame)
+            return
         # create entry in switch_table
         self.switch_table[frame.source] = [port_in, self.env.now]
         # valid switch_table entry -> add frame to buffer of port x
@@ -135,29 +197,87 @@ class Switch(Node):
                     self.on_frame_discard(frame)
                 else:
                     self.port_modules[destination_entry[0]][0].append_frame(frame)
-                    self.port_modules[destination_entry[0]][1].interrupt("new frame")
+                    self.signal_port(destination_entry[0], frame)
         except KeyError:
             self.broadcast_frame(frame, port_in)
 
     def broadcast_frame(self, frame, source_port):
-        self.env.sim_print("%s: %s broadcasting" % (str(self.address), str(frame)))
-        for port, port_module in self.port_modules.items():
+        if self.env.trace_level >= TRACE_ALL:
+            self.env.trace(BROADCASTING, self.address, frame)
+        if self.flood_ports is None:
+            ports = self.port_modules
+        elif source_port in self.port_modules and source_port not in self.flood_ports:
+            # frames received on a blocked port would loop, they are not broadcasted
+            self.on_frame_discard(frame)
+            return
+        else:
+            ports = self.flood_ports
+        for port in ports:
             # do not broadcast to source port
             if port != source_port:
-                port_module[0].append_frame(frame)
-                port_module[1].interrupt("new frame")
+                self.port_modules[port][0].append_frame(frame)
+                self.signal_port(port, frame)
+
+    def signal_port(self, port, frame):
+        """
+        tells the process of port that frame has been appended to its buffer
+        :param port: egress port
+        :param frame: appended frame
+        """
+        port_module = self.port_modules[port]
+        if not self.wake_idle_only:
+            port_module[1].interrupt("new frame")
+        elif self.idle_ports[port]:
+            self.idle_ports[port] = False
+            port_module[1].interrupt("new frame")
+        elif self.preemption and \
+                0 <= port_module[0].transmitting_traffic_class < port_module[0].get_traffic_class(frame):
+            # the frame on the wire may be preempted
+            port_module[1].interrupt("new frame")
+
+    def schedule_wakeup(self, port, buffer: SwitchBuffer, min_traffic_class: int = 0):
+        """
+        schedules a single wake up of the process of port for the time a blocked frame becomes available
+        :param port: port of the process
+        :param buffer: buffer of this port
+        :param min_traffic_class: only frames of traffic classes >= min_traffic_class are considered
+        """
+        wakeup_time = buffer.get_wakeup_time(min_traffic_class)
+        if wakeup_time is None:
+            return
+        wakeup = self.wakeups.get(port)
+        # a wake up which is only earlier by float rounding does not replace the pending one
+        if wakeup is not None and wakeup[0] <= wakeup_time + WAKEUP_TOLERANCE:
+            return
+        timeout = self.env.timeout(wakeup_time - self.env.now)
+        timeout.callbacks.append(lambda event: self.on_wakeup(port, event))
+        self.wakeups[port] = [wakeup_time, timeout]
+
+    def on_wakeup(self, port, event):
+        # ignore replaced wake ups, a replaced one may fire after the one which replaced it
+        wakeup = self.wakeups.get(port)
+        if wakeup is None or wakeup[1] is not event:
+            return
+        del self.wakeups[port]
+        # a busy port only needs to be woken for preemption, otherwise it checks its buffer when it is done
+        if self.idle_ports[port] or self.preemption:
+            self.idle_ports[port] = False
+            self.port_modules[port][1].interrupt("wake up")
 
     def on_frame_discard(self, frame):
-        self.env.sim_print("%s: %s discarded" % (str(self.address), str(frame)))
+        if self.env.trace_level >= TRACE_FRAME:
+            self.env.trace(DISCARDED, self.address, frame)
 
-    # switch param = (PrioMap, TSAMap, TSAConfig)
+    # switch param = (PrioMap, TSAMap, TSAConfig, QueueMap)
     def on_port_added(self, port, bandwidth, *args):
         if args.__len__() == 0:
             switch_param = SwitchPortParam()
         else:
             switch_param = args[0]
         switch_buffer = SwitchBuffer(self.env, bandwidth, switch_param.priority_map, switch_param.tsa_map,
-                                     switch_param.tsa_bandwidth, self.monitor)
+                                     switch_param.tsa_bandwidth, self.monitor, switch_param.queue_map, self.online,
+                                     self.address, port)
+        self.idle_ports[port] = False
         if self.preemption:
             self.port_modules[port] = [switch_buffer, self.env.process(
                 self.preemption_run(port, switch_buffer))]
@@ -186,29 +306,48 @@ class Switch(Node):
                     result.append(tmp)
         return result
 
+    def reset_monitor(self):
+        for port_module in self.port_modules.values():
+            port_module[0].reset_monitor()
+
+    def get_monitor_sketches(self):
+        return {port: port_module[0].get_waiting_time_sketch() for port, port_module in self.port_modules.items()}
+
     def get_monitor_results(self):
+        if self.online:
+            result = {port: online_monitor_results(port_module[0], self.env.now - self.env.monitor_start_time)
+                      for port, port_module in self.port_modules.items()}
+        else:
+            result = self.get_batch_monitor_results()
+        for port, port_module in self.port_modules.items():
+            result[port]["waiting_time_quantiles"] = \
+                port_module[0].get_waiting_time_sketch().quantiles(self.env.quantiles)
+        return result
+
+    def get_batch_monitor_results(self):
         result = {}
         for port, port_module in self.port_modules.items():
             append = port_module[0].data["append"]
             pop = port_module[0].data["pop"]
             if append.__len__() > 0:
-                if pop.__len__() > 0:
-                    # average_waiting_time = Zeit seid Betreten des Swichtes bis zum Verlassen
-                    # (inklusive Übertragungsdauer)
-                    _average_waiting_time = average_waiting_time(append, pop)
+                # average_waiting_time = Zeit seid Betreten des Swichtes bis zum Verlassen
+                # (inklusive Übertragungsdauer)
+                # -1 if no frame has been appended and transmitted since the monitors were reset
+                _average_waiting_time = average_waiting_time(append, pop) if pop.__len__() > 0 else -1
+                _standard_deviation_waiting_time = -1
+                if _average_waiting_time != -1:
                     _standard_deviation_waiting_time = standard_deviation_waiting_time(append, pop,
                                                                                        _average_waiting_time)
-                else:
-                    _average_waiting_time = -1
-                    _standard_deviation_waiting_time = -1
                 _average_packet_size = average_packet_size(append)
                 _standard_deviation_packet_size = standard_deviation_packet_size(append, _average_packet_size)
 
                 append_pop = append + pop
 
-                _average_queue_length = average_queue_length(append_pop, self.env.now)
+                start_time = self.env.monitor_start_time
+                _average_queue_length = average_queue_length(append_pop, self.env.now - start_time, start_time)
                 _standard_deviation_queue_length = standard_deviation_queue_length(append_pop, _average_queue_length,
-                                                                                   self.env.now)
+                                                                                   self.env.now - start_time,
+                                                                                   start_time)
             else:
                 _average_waiting_time = -1
                 _standard_deviation_waiting_time = -1
@@ -248,8 +387,8 @@ class Switch(Node):
                         buffer.transmission_start(frame)
                         yield sending_event
                         buffer.transmission_done(frame)
-                        self.env.sim_print("%s: %s send on port %s" %
-                                           (str(self.address), str(frame), str(port)))
+                        if self.env.trace_level >= TRACE_FRAME:
+                            self.env.trace(SEND, self.address, frame, port)
                 elif not buffer.empty():
                     # there might be a new frame to transmit
                     frame = buffer.peek_next_frame()
@@ -257,12 +396,15 @@ class Switch(Node):
                         sending_event = self.pop(frame, port)
                     else:
                         # no frame to transmit
+                        self.schedule_wakeup(port, buffer)
+                        self.idle_ports[port] = True
                         yield self.sleep_event
                 else:
                     # no frame to transmit
+                    self.idle_ports[port] = True
                     yield self.sleep_event
             except Interrupt:
-                pass
+                self.idle_ports[port] = False
 
     def preemption_run(self, port: int, buffer: SwitchBuffer):
         """
@@ -270,62 +412,72 @@ class Switch(Node):
         :param port: port of this process
         :param buffer: buffer of this process/port
         """
-        pending_events = {}
+        # { frame: Transmission } paused transmissions
+        pending_transmissions = {}
         frame = None
-        sending_event = None
-        inspector = None
+        transmission = None
         while True:
             try:
                 if frame is not None:
-                    if sending_event.processed:
+                    if transmission.sent:
                         # get a new frame
                         frame = buffer.peek_next_frame()
                         if frame is not None:
-                            try:
-                                sending_event, inspector = pending_events[frame]
-                                sending_event.interrupt("continue sending")
-                                self.env.sim_print("%s: %s continued on port %s" %
-                                                   (str(self.address), str(frame), str(port)))
-                            except KeyError:
-                                sending_event, inspector = self.pop(frame, port, inspector=True)
+                            transmission = self.start_transmission(frame, port, pending_transmissions)
                     else:
                         buffer.transmission_start(frame)
-                        yield sending_event
+                        # a blocked frame of a higher traffic class might preempt this frame
+                        self.schedule_wakeup(port, buffer, buffer.transmitting_traffic_class + 1)
+                        yield transmission.timeout
                         buffer.transmission_done(frame)
-                        pending_events.pop(frame, None)
-                        self.env.sim_print("%s: %s send on port %s" %
-                                           (str(self.address), str(frame), str(port)))
+                        if self.env.trace_level >= TRACE_FRAME:
+                            self.env.trace(SEND, self.address, frame, port)
                 elif not buffer.empty():
                     # there might be a frame for transmission
                     frame = buffer.peek_next_frame()
                     if frame is not None:
-                        try:
-                            sending_event, inspector = pending_events[frame]
-                            sending_event.interrupt("continue sending")
-                            self.env.sim_print("%s: %s continued on port %s" %
-                                               (str(self.address), str(frame), str(port)))
-                        except KeyError:
-                            sending_event, inspector = self.pop(frame, port, inspector=True)
+                        transmission = self.start_transmission(frame, port, pending_transmissions)
                     else:
                         # there is no frame for transmission
+                        self.schedule_wakeup(port, buffer)
+                        self.idle_ports[port] = True
                         yield self.sleep_event
                 else:
                     # there is no frame for transmission
+                    self.idle_ports[port] = True
                     yield self.sleep_event
             except Interrupt:
+                self.idle_ports[port] = False
                 if frame is not None:
                     new_frame = buffer.peek_next_frame()
-                    # inspector.process_interruptable() prevents a bug when we try to interrupt an event that would
-                    # be processed at the same time (e.g. the frame will be sent at the same time)
-                    if new_frame != frame and not sending_event.processed and inspector.process_interruptable():
-                        pending_events[frame] = sending_event, inspector
-                        sending_event.interrupt("stop sending")
+                    # transmission.interruptable() prevents pausing a transmission that would be finished at the
+                    # same time (e.g. the frame will be sent at the same time)
+                    if new_frame is not None and new_frame != frame and not transmission.sent \
+                            and transmission.interruptable():
+                        transmission.pause()
+                        pending_transmissions[frame] = transmission
                         buffer.transmission_pause(frame)
-                        self.env.sim_print(
-                            "%s: %s stopped on port %s" % (str(self.address), str(frame), str(port)))
+                        if self.env.trace_level >= TRACE_ALL:
+                            self.env.trace(STOPPED, self.address, frame, port)
                         frame = new_frame
                         # the receiver needs to know that a new frame is incoming (with a byte sequence)
                         # this is modeled by adding some extra bytes to this frame
-                        sending_event, inspector = self.pop(frame, port,
-                                                            extra_bytes=self.env.preemption_penalty_bytes,
-                                                            inspector=True)
+                        transmission = self.start_transmission(frame, port, pending_transmissions,
+                                                               self.env.preemption_penalty_bytes)
+
+    def start_transmission(self, frame, port: int, pending_transmissions: dict, extra_bytes: int = 0):
+        """
+        resumes the paused transmission of frame or starts a new one
+        :param frame: frame to transmit
+        :param port: egress port
+        :param pending_transmissions: { frame: Transmission } paused transmissions of this port
+        :param extra_bytes: additional bytes to send for a new transmission
+        :return: Transmission
+        """
+        transmission = pending_transmissions.pop(frame, None)
+        if transmission is None:
+            return self.pop(frame, port, extra_bytes, preemptable=True)
+        transmission.resume()
+        if self.env.trace_level >= TRACE_ALL:
+            self.env.trace(CONTINUED, self.address, frame, port)
+        return transmission
@@ -1,11 +1,13 @@
-from collections import defaultdict, deque
-from math import sqrt
+from collections import defaultdict, deque, OrderedDict
+from math import sqrt, nextafter, inf
 
 from simulation.frame import Frame
+from simulation.statistics import RunningStatistics, TimeWeightedStatistics, QuantileSketch
 
 
 class SwitchBuffer(object):
-    def __init__(self, env, port_transmit_rate: int, traffic_class_map, tsa_map, config, monitor: bool = False):
+    def __init__(self, env, port_transmit_rate: int, traffic_class_map, tsa_map, config, monitor: bool = False,
+                 queue_map=None, online: bool = False, address=None, port=None):
         """
         :param env:
         :param port_transmit_rate: Bandwdith of the connection
@@ -13,38 +15,96 @@ class SwitchBuffer(object):
         :param tsa_map: TransmissionSelectionAlgorithmMap for this port
         :param config: TrafficClassBandwidthMap for this port
         :param monitor:
+        :param queue_map: FrameQueueMap for this port, None = FrameFIFO for every traffic class
+        :param online: monitor with constant memory statistics instead of keeping every frame in data
+        :param address: address of the switch, for NetworkEnvironment.exporter
+        :param port: egress port of this buffer, for NetworkEnvironment.exporter
         """
         self.env = env
+        self.address = address
+        self.port = port
+        self.port_transmit_rate = port_transmit_rate
+        self.physical_delay = env.table[address][port][3] if address is not None else 0
         self.monitor = monitor
+        self.online = online
         self.data = defaultdict(list)
+        # online statistics
+        self.frames_received = 0
+        self.frames_send = 0
+        # { priority: RunningStatistics }, -1 = all priorities
+        self.waiting_time = defaultdict(RunningStatistics)
+        self.packet_size = RunningStatistics()
+        self.queue_length = TimeWeightedStatistics()
+        self.waiting_time_sketch = QuantileSketch(env.quantile_relative_accuracy)
+        # { frame.id: append time } of the queued frames
+        self.append_time = {}
+        # traffic class of the frame which is being transmitted, -1 if there is none
+        self.transmitting_traffic_class = -1
         self.t_class_p_map = traffic_class_map
         self.config = config
         # tsa = transmission selection algorithm
         self.tsa = []
-        for tsa, delta_bandwidth in zip(tsa_map.transmission_selection_algorithm_per_traffic_class,
-                                        config.bandwidth_param):
-            self.tsa.append(tsa(port_transmit_rate, delta_bandwidth))
+        for traffic_class, (tsa, delta_bandwidth) in enumerate(
+                zip(tsa_map.transmission_selection_algorithm_per_traffic_class, config.bandwidth_param)):
+            queue = queue_map.frame_queue_per_traffic_class[traffic_class]() if queue_map is not None else None
+            self.tsa.append(tsa(port_transmit_rate, delta_bandwidth, queue))
+        # priority -> traffic class, the row of traffic_class_map itself, so later changes of the map apply
+        self.priority_traffic_class = traffic_class_map.get_traffic_classes()
+        # number of frames in all queues
+        self.length = 0
+        # bit x is set if the queue of traffic class x is not empty
+        self.non_empty = 0
 
     # returns the next frame for transmission
     # selects the frame from the highest traffic class which has a frame available
     # see 802.1Q page: 127, block: 8.6.8
     def peek_next_frame(self):
-        for tsa in reversed(self.tsa):
-            frame = tsa.get_frame(self.env.now)
+        non_empty = self.non_empty
+        while non_empty:
+            traffic_class = non_empty.bit_length() - 1
+            frame = self.tsa[traffic_class].get_frame(self.env.now)
             if frame is not None:
                 return frame
+            non_empty ^= 1 << traffic_class
         return None
 
     def append_frame(self, frame: Frame):
         if self.monitor:
-            self.data["append"].append((self.env.now, self.__len__(), frame))
-        self.tsa[self.t_class_p_map.get_traffic_class(frame.priority)].append_frame(self.env.now, frame)
+            if self.env.exporter is not None:
+                self.export_frame("received", frame)
+            if self.online:
+                self.frames_received += 1
+                self.packet_size.add(frame.__len__())
+                self.queue_length.update(self.env.now, self.length)
+                self.append_time[frame.id] = self.env.now
+            else:
+                self.data["append"].append((self.env.now, self.length, frame))
+        traffic_class = self.priority_traffic_class[frame.priority]
+        self.tsa[traffic_class].append_frame(self.env.now, frame)
+        self.length += 1
+        self.non_empty |= 1 << traffic_class
+
+    # removes a frame from the queue of its traffic class and returns the traffic class
+    def remove_frame(self, frame: Frame):
+        traffic_class = self.priority_traffic_class[frame.priority]
+        tsa = self.tsa[traffic_class]
+        tsa.remove_frame(self.env.now, frame)
+        self.length -= 1
+        if tsa.queue.__len__() == 0:
+            self.non_empty &= ~(1 << traffic_class)
+        return traffic_class
 
     # drops a frame without transmitting it
     def drop_frame(self, frame: Frame):
         if self.monitor:
-            self.data["drop"].append((self.env.now, self.__len__(), frame))
-        self.tsa[self.t_class_p_map.get_traffic_class(frame.priority)].remove_frame(self.env.now, frame)
+            if self.env.exporter is not None:
+                self.export_frame("dropped", frame)
+            if self.online:
+                self.queue_length.update(self.env.now, self.length)
+                self.append_time.pop(frame.id, None)
+            else:
+                self.data["drop"].append((self.env.now, self.length, frame))
+        self.remove_frame(frame)
 
     # called when transmission of a frame is started
     def transmission_start(self, frame: Frame):
@@ -52,7 +112,8 @@ class SwitchBuffer(object):
         called when transmission of a frame is started
         :param frame:
         """
-        self.tsa[self.t_class_p_map.get_traffic_class(frame.priority)].transmitting(self.env.now, True)
+        self.transmitting_traffic_class = self.priority_traffic_class[frame.priority]
+        self.tsa[self.transmitting_traffic_class].transmitting(self.env.now, True)
 
     # called when transmission of a frame is paused, e.g. frame preemption
     def transmission_pause(self, frame: Frame):
@@ -60,7 +121,8 @@ class SwitchBuffer(object):
         called when transmission of a frame is paused, e.g. frame preemption
         :param frame:
         """
-        self.tsa[self.t_class_p_map.get_traffic_class(frame.priority)].transmitting(self.env.now, False)
+        self.transmitting_traffic_class = -1
+        self.tsa[self.priority_traffic_class[frame.priority]].transmitting(self.env.now, False)
 
     # called when transmission of a frame is done, the frame is removed from the queue
     def transmission_done(self, frame: Frame):
@@ -69,19 +131,75 @@ class SwitchBuffer(object):
         :param frame:
         """
         if self.monitor:
-            self.data["pop"].append((self.env.now, self.__len__(), frame))
-        traffic_class = self.t_class_p_map.get_traffic_class(frame.priority)
-        self.tsa[traffic_class].remove_frame(self.env.now, frame)
+            if self.env.exporter is not None:
+                self.export_frame("transmitted", frame)
+            if self.online:
+                self.frames_send += 1
+                self.queue_length.update(self.env.now, self.length)
+                append_time = self.append_time.pop(frame.id, None)
+                # a frame which is queued twice on this port is counted once
+                if append_time is not None:
+                    waiting_time = self.env.now - append_time
+                    self.waiting_time[frame.priority].add(waiting_time)
+                    self.waiting_time[-1].add(waiting_time)
+                    self.waiting_time_sketch.add(waiting_time)
+            else:
+                self.data["pop"].append((self.env.now, self.length, frame))
+        traffic_class = self.remove_frame(frame)
         self.tsa[traffic_class].transmitting(self.env.now, False)
+        self.transmitting_traffic_class = -1
+
+    # writes one row of Switch.get_monitor_table to NetworkEnvironment.exporter, call before the queue changes
+    def export_frame(self, action, frame: Frame):
+        env = self.env
+        env.exporter.append_switch_row((env.name, env.id, env.seed, self.address, self.port,
+                                        frame.length * 8 / self.port_transmit_rate, self.physical_delay,
+                                        frame.id, frame.source, frame.destination, frame.length, frame.priority,
+                                        action, env.now, self.length))
+
+    def get_wakeup_time(self, min_traffic_class: int = 0):
+        """
+        :param min_traffic_class: only traffic classes >= min_traffic_class are considered
+        :return: earliest time a queued frame of a blocked traffic class becomes available, None if there is none
+        """
+        wakeup_time = None
+        non_empty = self.non_empty >> min_traffic_class << min_traffic_class
+        while non_empty:
+            traffic_class = non_empty.bit_length() - 1
+            tsa_wakeup_time = self.tsa[traffic_class].get_wakeup_time(self.env.now)
+            if tsa_wakeup_time is not None and (wakeup_time is None or tsa_wakeup_time < wakeup_time):
+                wakeup_time = tsa_wakeup_time
+            non_empty ^= 1 << traffic_class
+        return wakeup_time
+
+    # discards everything monitored so far, frames queued now are not part of the waiting time statistics
+    def reset_monitor(self):
+        self.data = defaultdict(list)
+        self.frames_received = 0
+        self.frames_send = 0
+        self.waiting_time = defaultdict(RunningStatistics)
+        self.packet_size = RunningStatistics()
+        self.queue_length = TimeWeightedStatistics(self.env.now)
+        self.waiting_time_sketch = QuantileSketch(self.env.quantile_relative_accuracy)
+        self.append_time = {}
+
+    # QuantileSketch of the waiting time of all frames transmitted on this port
+    def get_waiting_time_sketch(self):
+        if self.online:
+            return self.waiting_time_sketch
+        sketch = QuantileSketch(self.env.quantile_relative_accuracy)
+        for priority, waiting_time in waiting_times(self.data["append"], self.data["pop"]):
+            sketch.add(waiting_time)
+        return sketch
+
+    def get_traffic_class(self, frame: Frame):
+        return self.priority_traffic_class[frame.priority]
 
     def empty(self):
-        return self.__len__() == 0
+        return self.length == 0
 
     def __len__(self):
-        length = 0
-        for tsa in self.tsa:
-            length += tsa.queue.__len__()
-        return length
+        return self.length
 
 
 class FrameQueue(object):
@@ -98,18 +216,69 @@ class FrameQueue(object):
         pass
 
 
+# removing the head frame is O(1), removing any other frame is O(1) amortized:
+# the frame is only marked as removed and skipped once it reaches the head
+# the same frame may be queued more than once (e.g. flooded in a loop)
 class FrameFIFO(FrameQueue):
     def __init__(self):
         self.queue = deque()
+        # { frame: number of times frame is queued }
+        self.count = defaultdict(int)
+        # { frame: number of removed copies of frame still in queue }
+        self.removed = defaultdict(int)
+        self.length = 0
 
     def append(self, frame):
         self.queue.append(frame)
+        self.count[frame] += 1
+        self.length += 1
 
     def remove(self, frame):
-        self.queue.remove(frame)
+        count = self.count.get(frame, 0)
+        if count == 0:
+            raise ValueError("%s is not in this queue" % str(frame))
+        if count == 1:
+            del self.count[frame]
+        else:
+            self.count[frame] = count - 1
+        self.length -= 1
+        if self.queue[0] is frame:
+            self.queue.popleft()
+        else:
+            self.removed[frame] += 1
+
+    def get_head_frame(self):
+        frame = self.queue[0]
+        while frame in self.removed:
+            self.queue.popleft()
+            if self.removed[frame] == 1:
+                del self.removed[frame]
+            else:
+                self.removed[frame] -= 1
+            frame = self.queue[0]
+        return frame
+
+    def __len__(self):
+        return self.length
+
+
+# FIFO indexed by frame id, head removal and removal of any frame are O(1)
+# a frame must not be queued twice, use FrameFIFO on topologies where flooded frames can loop
+class FrameIndexedFIFO(FrameQueue):
+    def __init__(self):
+        # { frame.id: frame } in order of arrival
+        self.queue = OrderedDict()
+
+    def append(self, frame):
+        if frame.id in self.queue:
+            raise ValueError("%s is already in this queue" % str(frame))
+        self.queue[frame.id] = frame
+
+    def remove(self, frame):
+        del self.queue[frame.id]
 
     def get_head_frame(self):
-        return self.queue[0]
+        return next(iter(self.queue.values()))
 
     def __len__(self):
         return self.queue.__len__()
@@ -142,6 +311,10 @@ class TransmissionSelectionAlgorithm(object):
     def transmitting(self, time, status):
         pass
 
+    # returns the time when a queued frame becomes available for transmission, None if this is unknown
+    def get_wakeup_time(self, time):
+        return None
+
 
 class StrictPriorityAlgorithm(TransmissionSelectionAlgorithm):
     def __init__(self, *args, **kwargs):
@@ -183,6 +356,17 @@ class CreditBasedShaper(TransmissionSelectionAlgorithm):
         self.update_credit(time)
         self.transmit = status
 
+    # time when the credit reaches 0 again
+    def get_wakeup_time(self, time):
+        self.update_credit(time)
+        if self.queue.__len__() == 0 or self.transmit_allowed or self.transmit or self.idle_slope <= 0:
+            return None
+        wakeup_time = time - self.credit / self.idle_slope
+        if wakeup_time <= time:
+            # the credit is too close to 0 to advance the time
+            wakeup_time = nextafter(time, inf)
+        return wakeup_time
+
     def update_credit(self, time):
         passed_time = time - self.transmit_time
         if self.transmit:
@@ -200,12 +384,22 @@ class CreditBasedShaper(TransmissionSelectionAlgorithm):
         self.transmit_time = time
 
 
+# yields (priority, waiting_time) for every popped frame, append and pop are matched by frame id
+def waiting_times(append, pop):
+    append_time = {}
+    for a_frame in append:
+        append_time[a_frame[2].id] = a_frame[0]
+    for p_frame in pop:
+        a_time = append_time.pop(p_frame[2].id, None)
+        if a_time is not None:
+            yield p_frame[2].priority, p_frame[0] - a_time
+
+
 def average_waiting_time(append, pop):
     stats = defaultdict(list)
     stats[-1] = [0, 0]
-    for a_frame, p_frame in zip(sorted(append, key=lambda p: p[2].id), sorted(pop, key=lambda p: p[2].id)):
-        waiting_time = p_frame[0] - a_frame[0]
-        tmp = stats[a_frame[2].priority]
+    for priority, waiting_time in waiting_times(append, pop):
+        tmp = stats[priority]
         if tmp.__len__() == 0:
             tmp.append(0)
             tmp.append(0)
@@ -214,19 +408,20 @@ def average_waiting_time(append, pop):
         tmp = stats[-1]
         tmp[0] += waiting_time
         tmp[1] += 1
+    if stats[-1][1] == 0:
+        return -1
     return {key: value[0] / value[1] for key, value in sorted(stats.items())}
 
 
 def standard_deviation_waiting_time(append, pop, _average_waiting_time):
     stats = defaultdict(list)
     stats[-1] = [0, 0]
-    for a_frame, p_frame in zip(sorted(append, key=lambda p: p[2].id), sorted(pop, key=lambda p: p[2].id)):
-        waiting_time = p_frame[0] - a_frame[0]
-        tmp = stats[a_frame[2].priority]
+    for priority, waiting_time in waiting_times(append, pop):
+        tmp = stats[priority]
         if tmp.__len__() == 0:
             tmp.append(0)
             tmp.append(0)
-        tmp[0] += pow(waiting_time - _average_waiting_time[a_frame[2].priority], 2)
+        tmp[0] += pow(waiting_time - _average_waiting_time[priority], 2)
         tmp[1] += 1
         tmp = stats[-1]
         tmp[0] += pow(waiting_time - _average_waiting_time[-1], 2)
@@ -234,9 +429,10 @@ def standard_deviation_waiting_time(append, pop, _average_waiting_time):
     return {key: value[0] / ((value[1] - 1) if value[1] > 1 else 1) for key, value in sorted(stats.items())}
 
 
-def average_queue_length(data, runtime):
+# start_time = sim_time the data starts at, runtime = time since start_time
+def average_queue_length(data, runtime, start_time=0):
     queue_len = 0
-    last_time = 0
+    last_time = start_time
     for frame in sorted(data, key=lambda p: p[0]):
         q_time = (frame[0] - last_time) / runtime
         last_time = frame[0]
@@ -244,9 +440,9 @@ def average_queue_length(data, runtime):
     return queue_len
 
 
-def standard_deviation_queue_length(data, _average_queue_length, runtime):
+def standard_deviation_queue_length(data, _average_queue_length, runtime, start_time=0):
     queue_len = 0
-    last_time = 0
+    last_time = start_time
     for frame in sorted(data, key=lambda p: p[0]):
         q_time = frame[0] - last_time
         last_time = frame[0]
@@ -268,4 +464,35 @@ def standard_deviation_packet_size(append, _average_packet_size):
     frame_count = append.__len__() - 1 if append.__len__() > 1 else 1
     for frame in append:
         frame_length += pow(frame[2].__len__() - _average_packet_size, 2) / frame_count
-    return sqrt(frame_length)
\ No newline at end of file
+    return sqrt(frame_length)
+
+
+# same results as Switch.get_monitor_results, taken from the online statistics of buffer
+def online_monitor_results(buffer, runtime):
+    if buffer.frames_received > 0:
+        if buffer.waiting_time[-1].count > 0:
+            _average_waiting_time = {key: value.mean for key, value in sorted(buffer.waiting_time.items())}
+            _standard_deviation_waiting_time = {key: value.variance()
+                                                for key, value in sorted(buffer.waiting_time.items())}
+        else:
+            _average_waiting_time = -1
+            _standard_deviation_waiting_time = -1
+        _average_packet_size = buffer.packet_size.mean
+        _standard_deviation_packet_size = buffer.packet_size.standard_deviation()
+        _average_queue_length = buffer.queue_length.mean(runtime)
+        _standard_deviation_queue_length = buffer.queue_length.standard_deviation(runtime)
+    else:
+        _average_waiting_time = -1
+        _standard_deviation_waiting_time = -1
+        _average_packet_size = -1
+        _standard_deviation_packet_size = -1
+        _average_queue_length = -1
+        _standard_deviation_queue_length = -1
+    return {"frames_received": buffer.frames_received,
+            "frames_send": buffer.frames_send,
+            "average_waiting_time": _average_waiting_time,
+            "standard_deviation_waiting_time": _standard_deviation_waiting_time,
+            "average_queue_length": _average_queue_length,
+            "standard_deviation_queue_length": _standard_deviation_queue_length,
+            "average_packet_size": _average_packet_size,
+            "standard_deviation_packet_size": _standard_deviation_packet_size}
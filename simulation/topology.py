@@ -0,0 +1,182 @@
+import numpy as np
+
+from simulation.switch import Switch, SwitchPortParam
+from simulation.node import Sink
+
+
+class Topology(object):
+    def __init__(self, addresses, switch_count: int, node_a, node_b, bandwidth=10, channel_length=0):
+        """
+        links of a network stored as arrays, nodes are numbered by their position in addresses.
+        the adjacency is kept in compressed sparse row form: the entries of node u are
+        offsets[u]..offsets[u + 1] - 1, entry j is the link links[j] to neighbours[j], port_out of u is
+        j - offsets[u] + 1 and port_in of the neighbour is ports_in[j]. ports are numbered in link order, the same
+        way NetworkBuilder.connect_nodes numbers them
+        :param addresses: addresses of all nodes, the first switch_count are switches, the others are hosts
+        :param switch_count: number of switches
+        :param node_a: first node of each link
+        :param node_b: second node of each link
+        :param bandwidth: bandwidth of each link or of all links
+        :param channel_length: channel length of each link or of all links in meter
+        """
+        self.addresses = list(addresses)
+        self.switch_count = switch_count
+        self.node_a = np.asarray(node_a, dtype=np.int64)
+        self.node_b = np.asarray(node_b, dtype=np.int64)
+        link_count = self.node_a.__len__()
+        if self.node_b.__len__() != link_count:
+            raise ValueError("node_a and node_b need the same length")
+        if np.any(self.node_a == self.node_b):
+            raise ValueError("a node can not be connected to itself")
+        self.bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=np.float64), (link_count,))
+        self.channel_length = np.broadcast_to(np.asarray(channel_length, dtype=np.float64), (link_count,))
+
+        # both directions of link i are entries 2i (a -> b) and 2i + 1 (b -> a), a stable sort by node keeps the
+        # link order within each row
+        source = np.stack((self.node_a, self.node_b), axis=1).reshape(-1)
+        destination = np.stack((self.node_b, self.node_a), axis=1).reshape(-1)
+        order = np.argsort(source, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(order.__len__())
+        self.offsets = np.zeros(self.addresses.__len__() + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=self.addresses.__len__()), out=self.offsets[1:])
+        self.neighbours = destination[order]
+        self.links = order // 2
+        # the reverse direction of entry 2i is 2i + 1 and the other way round
+        self.ports_in = position[order ^ 1] - self.offsets[self.neighbours] + 1
+
+    @property
+    def node_count(self):
+        return self.addresses.__len__()
+
+    @property
+    def link_count(self):
+        return self.node_a.__len__()
+
+    def degree(self, node: int):
+        return int(self.offsets[node + 1] - self.offsets[node])
+
+    def is_switch(self, node: int):
+        return node < self.switch_count
+
+
+def line_topology(switch_count: int, hosts_per_switch: int = 1, bandwidth=10, channel_length=0):
+    """
+    switch0 - switch1 - .. - switch(n-1), each switch with hosts_per_switch hosts host<switch>_<i>
+    """
+    node_a = np.arange(0, switch_count - 1)
+    return _with_hosts(["switch%d" % i for i in range(0, switch_count)], node_a, node_a + 1, hosts_per_switch,
+                       "host%d_%d", bandwidth, bandwidth, channel_length)
+
+
+def ring_topology(switch_count: int, hosts_per_switch: int = 1, bandwidth=10, channel_length=0):
+    """
+    line_topology with an additional link between the last and the first switch
+    """
+    node_a = np.arange(0, switch_count)
+    node_b = (node_a + 1) % switch_count
+    if switch_count < 3:
+        node_a, node_b = node_a[:switch_count - 1], node_b[:switch_count - 1]
+    return _with_hosts(["switch%d" % i for i in range(0, switch_count)], node_a, node_b, hosts_per_switch,
+                       "host%d_%d", bandwidth, bandwidth, channel_length)
+
+
+def star_topology(host_count: int, bandwidth=10, channel_length=0):
+    """
+    one switch "switch" with host_count hosts host0_<i>
+    """
+    return _with_hosts(["switch"], [], [], host_count, "host%d_%d", bandwidth, bandwidth, channel_length)
+
+
+def leaf_spine_topology(leaf_count: int, spine_count: int, hosts_per_leaf: int, bandwidth=10,
+                        uplink_bandwidth=None, channel_length=0):
+    """
+    every leaf<i> is connected to every spine<j>, each leaf has hosts_per_leaf hosts host<i>_<k>
+    :param bandwidth: bandwidth of the host links
+    :param uplink_bandwidth: bandwidth of the leaf - spine links, None = bandwidth
+    """
+    leaf, spine = np.indices((leaf_count, spine_count)).reshape(2, -1)
+    addresses = ["spine%d" % j for j in range(0, spine_count)] + ["leaf%d" % i for i in range(0, leaf_count)]
+    uplink_bandwidth = bandwidth if uplink_bandwidth is None else uplink_bandwidth
+    return _with_hosts(addresses, leaf + spine_count, spine, hosts_per_leaf, "host%d_%d", bandwidth,
+                       uplink_bandwidth, channel_length, first_edge=spine_count)
+
+
+def fat_tree_topology(k: int, bandwidth=10, uplink_bandwidth=None, channel_length=0):
+    """
+    k-ary fat-tree: k pods of k/2 edge and k/2 aggregation switches and (k/2)^2 core switches.
+    edge<p>_<i> is connected to every aggregation<p>_<j> of its pod and to k/2 hosts host<p>_<i>_<h>,
+    aggregation<p>_<j> is connected to core<j * k/2> .. core<j * k/2 + k/2 - 1>
+    :param k: even number of ports per switch
+    :param bandwidth: bandwidth of the host links
+    :param uplink_bandwidth: bandwidth of the switch - switch links, None = bandwidth
+    """
+    if k < 2 or k % 2 != 0:
+        raise ValueError("k has to be an even number >= 2")
+    half = k // 2
+    core_count = half * half
+    aggregation = core_count
+    edge = aggregation + k * half
+    addresses = ["core%d" % i for i in range(0, core_count)] + \
+                ["aggregation%d_%d" % (pod, i) for pod in range(0, k) for i in range(0, half)] + \
+                ["edge%d_%d" % (pod, i) for pod in range(0, k) for i in range(0, half)]
+    # aggregation <pod>_<j> - core <j * half + i>
+    pod, j, i = np.indices((k, half, half)).reshape(3, -1)
+    aggregation_a = aggregation + pod * half + j
+    core_b = j * half + i
+    # edge <pod>_<i> - aggregation <pod>_<j>
+    pod, i, j = np.indices((k, half, half)).reshape(3, -1)
+    edge_a = edge + pod * half + i
+    aggregation_b = aggregation + pod * half + j
+    uplink_bandwidth = bandwidth if uplink_bandwidth is None else uplink_bandwidth
+    topology = _with_hosts(addresses, np.concatenate((aggregation_a, edge_a)),
+                           np.concatenate((core_b, aggregation_b)), half, "host%d_%d", bandwidth, uplink_bandwidth,
+                           channel_length, first_edge=edge)
+    # host<edge>_<h> -> host<pod>_<i>_<h>
+    topology.addresses[edge + k * half:] = ["host%d_%d_%d" % (pod, i, h) for pod in range(0, k)
+                                            for i in range(0, half) for h in range(0, half)]
+    return topology
+
+
+def _with_hosts(addresses, node_a, node_b, hosts_per_switch, host_address, bandwidth, uplink_bandwidth,
+                channel_length, first_edge=0):
+    """
+    adds hosts_per_switch hosts to each switch from first_edge on, host links come after the switch links
+    :param addresses: addresses of the switches
+    :param host_address: format of the host addresses, (number of the edge switch, number of the host)
+    """
+    switch_count = addresses.__len__()
+    edge_switch, host = np.indices((switch_count - first_edge, hosts_per_switch)).reshape(2, -1)
+    addresses = addresses + [host_address % (e, h) for e in range(0, switch_count - first_edge)
+                             for h in range(0, hosts_per_switch)]
+    node_a = np.asarray(node_a, dtype=np.int64)
+    bandwidth = np.concatenate((np.full(node_a.__len__(), uplink_bandwidth, dtype=np.float64),
+                                np.full(host.__len__(), bandwidth, dtype=np.float64)))
+    return Topology(addresses, switch_count, np.concatenate((node_a, edge_switch + first_edge)),
+                    np.concatenate((np.asarray(node_b, dtype=np.int64), switch_count + np.arange(host.__len__()))),
+                    bandwidth, channel_length)
+
+
+def build_topology(env, topology: Topology, switch_factory=None, host_factory=None,
+                   switch_param: SwitchPortParam = None, channel_type=None):
+    """
+    creates the nodes of topology and connects them, see NetworkBuilder.connect_topology
+    :param env: NetworkEnvironment
+    :param topology: Topology, e.g. fat_tree_topology(4)
+    :param switch_factory: (env, address) -> Node for the switches, default Switch
+    :param host_factory: (env, address) -> Node for the hosts, default Sink
+    :param switch_param: SwitchPortParam of all switch ports, None = one default SwitchPortParam for all ports
+    :param channel_type: channel_type of all links
+    :return: returns NetworkEnvironment
+    """
+    switch_factory = switch_factory if switch_factory is not None else Switch
+    host_factory = host_factory if host_factory is not None else Sink
+    addresses = topology.addresses
+    nodes = [switch_factory(env, address) for address in addresses[:topology.switch_count]] + \
+            [host_factory(env, address) for address in addresses[topology.switch_count:]]
+    env.builder.append_nodes(*nodes).connect_topology(topology, channel_type, switch_param)
+    return env
+
+
+TOPOLOGIES = {"line": line_topology, "ring": ring_topology, "star": star_topology,
+              "leaf_spine": leaf_spine_topology, "fat_tree": fat_tree_topology}
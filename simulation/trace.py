@@ -0,0 +1,61 @@
+import csv
+
+# trace levels, a trace call site only formats/records if NetworkEnvironment.trace_level >= level of the event
+TRACE_OFF = 0
+# frames entering and leaving nodes: received, send, discarded
+TRACE_FRAME = 1
+# everything: transmission start, broadcasts, preemption, node internals
+TRACE_ALL = 2
+
+# trace events = (name, level, text format)
+# text format gets (node address, frame, port)
+RECEIVED = ("received", TRACE_FRAME, "%s: %s received on port %s")
+SEND = ("send", TRACE_FRAME, "%s: %s send on port %s")
+DISCARDED = ("discarded", TRACE_FRAME, "%s: %s discarded%.0s")
+SENDING = ("sending", TRACE_ALL, "%s: %s sending on port %s")
+BROADCASTING = ("broadcasting", TRACE_ALL, "%s: %s broadcasting%.0s")
+STOPPED = ("stopped", TRACE_ALL, "%s: %s stopped on port %s")
+CONTINUED = ("continued", TRACE_ALL, "%s: %s continued on port %s")
+
+
+class Tracer(object):
+    def __init__(self, level: int = TRACE_ALL, text: bool = True, records: bool = False, file=None):
+        """
+        Receives trace events from a NetworkEnvironment. Call sites check the level before calling trace,
+        so a disabled trace does no formatting and no allocation
+        :param level: TRACE_OFF, TRACE_FRAME or TRACE_ALL
+        :param text: print events as text, like sim_print
+        :param records: keep a structured record (time, node, port, frame_id, action) per event
+        :param file: if given, records are written as csv rows to this file object instead of kept in memory
+        """
+        self.level = level
+        self.text = text
+        self.records = records
+        self.data = []
+        self.writer = None
+        if file is not None:
+            self.writer = csv.writer(file, delimiter=",", lineterminator="\n")
+            self.writer.writerow(("time", "node", "port", "frame_id", "action"))
+
+    def trace(self, now, event, address, frame, port=None):
+        """
+        :param now: sim_time of this event
+        :param event: trace event, e.g. RECEIVED
+        :param address: address of the node
+        :param frame: frame of this event
+        :param port: port of this event, if there is one
+        """
+        if self.text:
+            print("%0.2f: %s" % (now, event[2] % (str(address), str(frame), str(port))))
+        if self.records:
+            record = (now, address, port, frame.id, event[0])
+            if self.writer is not None:
+                self.writer.writerow(record)
+            else:
+                self.data.append(record)
+
+    def get_records(self):
+        """
+        :return: list of (time, node, port, frame_id, action)
+        """
+        return self.data
@@ -0,0 +1,110 @@
+"""
+checks of simulation.cache, run with python -m pytest tests or python -m tests.test_cache
+"""
+import functools
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from simulation.cache import ResultCache, FileInput, describe
+from simulation.scenario import ScenarioFactory
+
+
+class Unpicklable(object):
+    def __reduce__(self):
+        raise RuntimeError("can not be pickled")
+
+
+def factory(seed, load=0.5):
+    return seed, load
+
+
+def test_put_get():
+    with tempfile.TemporaryDirectory() as path:
+        cache = ResultCache(path)
+        key = cache.key(factory, 1, 1000)
+        assert cache.get(key) is None
+        cache.put(key, {"result": [1, 2.5]})
+        assert cache.get(key) == {"result": [1, 2.5]}
+        assert ResultCache(path, force=True).get(key) is None
+
+
+def test_put_is_atomic():
+    with tempfile.TemporaryDirectory() as path:
+        cache = ResultCache(path)
+        key = cache.key(factory, 1, 1000)
+        cache.put(key, "old")
+        try:
+            cache.put(key, ["new", Unpicklable()])
+            raise AssertionError("put an unpicklable value")
+        except RuntimeError:
+            pass
+        # neither a partial entry nor a temporary file is left
+        assert cache.get(key) == "old"
+        assert [file_name for directory, directory_names, file_names in os.walk(path)
+                for file_name in file_names] == [os.path.basename(cache.file_name(key))]
+
+
+def test_evict():
+    with tempfile.TemporaryDirectory() as path:
+        cache = ResultCache(path)
+        keys = [cache.key(factory, seed, 1000) for seed in range(0, 4)]
+        now = time.time()
+        for i, key in enumerate(keys):
+            cache.put(key, bytes(1000))
+            os.utime(cache.file_name(key), (now - 1000 + i * 100, now - 1000 + i * 100))
+        # get marks keys[0] as the most recently used entry
+        assert cache.get(keys[0]) is not None
+        size = cache.entries()[0][1]
+        assert ResultCache(path, max_size=2 * size).evict() == 2
+        assert [cache.get(key) is not None for key in keys] == [True, False, False, True]
+        os.utime(cache.file_name(keys[3]), (now - 1000, now - 1000))
+        assert ResultCache(path, max_age=500).evict() == 1
+        assert [cache.get(key) is not None for key in keys] == [True, False, False, False]
+        cache.clear()
+        assert cache.entries() == []
+
+
+def test_key():
+    with tempfile.TemporaryDirectory() as path:
+        cache = ResultCache(path)
+        key = cache.key(functools.partial(factory, load=0.5), 1, 1000.0, None)
+        assert key == cache.key(functools.partial(factory, load=0.5), np.int64(1), 1000.0, None)
+        assert key != cache.key(functools.partial(factory, load=0.6), 1, 1000.0, None)
+        assert key != cache.key(functools.partial(factory, load=0.5), 2, 1000.0, None)
+        try:
+            cache.key(functools.partial(factory, load=Unpicklable()), 1)
+            raise AssertionError("described an object without a describe method")
+        except TypeError:
+            pass
+
+
+def test_file_input():
+    with tempfile.TemporaryDirectory() as path:
+        file_name = os.path.join(path, "trace")
+        with open(file_name, "wb") as file:
+            file.write(b"first")
+        with open(file_name + ".json", "w") as file:
+            file.write("{}")
+        scenario = {"name": "replay", "nodes": [{"type": "replay", "address": "Replay", "file_name": file_name}]}
+        cache = ResultCache(os.path.join(path, "cache"))
+        # a plain string is only a string, a FileInput is described by the content of the file
+        plain_key = cache.key(functools.partial(factory, file_name))
+        marked_key = cache.key(functools.partial(factory, FileInput(file_name)))
+        scenario_key = cache.key(ScenarioFactory(scenario))
+        # a different size, file_hash notices the change even within the resolution of the modification time
+        with open(file_name, "wb") as file:
+            file.write(b"second")
+        assert cache.key(functools.partial(factory, file_name)) == plain_key
+        assert cache.key(functools.partial(factory, FileInput(file_name))) != marked_key
+        assert cache.key(ScenarioFactory(scenario)) != scenario_key
+        assert describe(FileInput(file_name))["file"] == file_name
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
@@ -0,0 +1,63 @@
+"""
+checks of simulation.generators, run with python -m pytest tests or python -m tests.test_generators
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from simulation.generators import SizeDistribution, SIMPLE_IMIX, TOLLY_IMIX
+
+
+def alias_frequency(distribution):
+    # probability of each size implied by the alias table
+    count = distribution.sizes.__len__()
+    frequency = distribution.probability.copy()
+    np.add.at(frequency, distribution.alias, 1 - distribution.probability)
+    return frequency / count
+
+
+def test_alias_table():
+    weights = np.random.default_rng(4).pareto(1, 50)
+    weights[[3, 17]] = 0
+    for distribution in (SizeDistribution(np.arange(64, 114), weights), SizeDistribution((100,), (2,)),
+                         SIMPLE_IMIX, TOLLY_IMIX):
+        assert np.allclose(alias_frequency(distribution), distribution.frequency, rtol=0, atol=1e-12)
+
+
+def test_sample():
+    random = np.random.RandomState(5)
+    samples = TOLLY_IMIX.sample(random, 200000)
+    for size, frequency in zip(TOLLY_IMIX.sizes.tolist(), TOLLY_IMIX.frequency.tolist()):
+        observed = np.count_nonzero(samples == size) / samples.__len__()
+        assert abs(observed - frequency) < 5 * np.sqrt(frequency * (1 - frequency) / samples.__len__())
+    assert abs(samples.mean() - TOLLY_IMIX.mean()) < 0.01 * TOLLY_IMIX.mean()
+    assert SizeDistribution((64, 1518), (0, 1)).sample(random, 1000).tolist() == [1518] * 1000
+
+
+def test_from_cdf_and_csv():
+    distribution = SizeDistribution.from_cdf((64, 570, 1518), (7, 11, 12))
+    assert np.allclose(distribution.frequency, SIMPLE_IMIX.frequency)
+    descriptor, file_name = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(descriptor, "w") as file:
+            file.write("size,count\n64,7\n570,4\n1518,1\n")
+        assert np.allclose(SizeDistribution.from_csv(file_name).frequency, SIMPLE_IMIX.frequency)
+    finally:
+        os.remove(file_name)
+
+
+def test_invalid_weights():
+    for sizes, weights in (((), ()), ((64, 128), (1,)), ((64, 128), (1, -1)), ((64, 128), (0, 0))):
+        try:
+            SizeDistribution(sizes, weights)
+            raise AssertionError("accepted sizes %s with weights %s" % (sizes, weights))
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
@@ -0,0 +1,52 @@
+"""
+checks of simulation.simulation_wrapper, run with python -m pytest tests or python -m tests.test_simulation_wrapper
+"""
+import numpy as np
+
+from simulation.scenario import build_scenario
+from simulation.simulation_wrapper import lag1_autocorrelation, simulate_batch_means
+from tests.test_statistics import scenario
+
+
+def ar1(phi, count, seed):
+    noise = np.random.default_rng(seed).normal(0, 1, count)
+    series = np.empty(count)
+    series[0] = noise[0]
+    for i in range(1, count):
+        series[i] = phi * series[i - 1] + noise[i]
+    return series
+
+
+def test_lag1_autocorrelation():
+    count = 5000
+    results = [{"ar1": a, "noise": b, "alternating": (-1) ** i, "constant": 3, "nested": {"ar1": a}}
+               for i, (a, b) in enumerate(zip(ar1(0.8, count, 7).tolist(), ar1(0, count, 8).tolist()))]
+    autocorrelation = lag1_autocorrelation(results)
+    assert abs(autocorrelation["ar1"] - 0.8) < 0.05
+    assert abs(autocorrelation["noise"]) < 4 / np.sqrt(count)
+    assert abs(autocorrelation["alternating"] + 1) < 1e-3
+    assert autocorrelation["constant"] == 0
+    assert autocorrelation["nested"]["ar1"] == autocorrelation["ar1"]
+
+
+def test_lag1_autocorrelation_skips_missing_results():
+    # -1 = a batch without data for a nested result
+    results = [{"switch": {"latency": value}} for value in (1.0, 2.0, 3.0)] + [{"switch": -1}]
+    assert lag1_autocorrelation(results) == lag1_autocorrelation(results[:3])
+
+
+def test_simulate_batch_means():
+    env = build_scenario(scenario(True), 7)
+    result = simulate_batch_means(iter([env]), 10, 20000, 0.95)["online"]
+    assert env.now == 10 * 20000
+    assert result["batches"] == 10
+    assert result["max_lag1_autocorrelation"] <= 1
+    assert result["independent"] == (result["max_lag1_autocorrelation"] <= 0.2)
+    assert set(result["combined_result"]) == set(result["lag1_autocorrelation"])
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
@@ -0,0 +1,150 @@
+"""
+checks of simulation.statistics, run with python -m pytest tests or python -m tests.test_statistics
+"""
+import numpy as np
+
+from simulation.scenario import build_scenario
+from simulation.statistics import RunningStatistics, TimeWeightedStatistics, QuantileSketch, mser
+
+
+def test_running_statistics():
+    values = np.random.default_rng(1).normal(1e6, 3, 10000)
+    statistics = RunningStatistics()
+    for value in values.tolist():
+        statistics.add(value)
+    assert statistics.count == values.__len__()
+    assert abs(statistics.mean - values.mean()) < 1e-6
+    # a large mean does not cancel out the small variance
+    assert abs(statistics.variance() - values.var(ddof=1)) < 1e-6 * values.var(ddof=1)
+
+
+def test_running_statistics_single_value():
+    statistics = RunningStatistics()
+    statistics.add(5)
+    assert statistics.mean == 5
+    assert statistics.variance() == 0
+
+
+def test_time_weighted_statistics():
+    # value 2 for 1 µs, 4 for 3 µs, 0 for the remaining 4 µs
+    statistics = TimeWeightedStatistics(start_time=10)
+    statistics.update(11, 2)
+    statistics.update(14, 4)
+    samples = np.repeat([2, 4, 0], [1, 3, 4])
+    assert abs(statistics.mean(8) - samples.mean()) < 1e-12
+    # like standard_deviation_queue_length, the time after the last update does not count
+    assert abs(statistics.standard_deviation(8) - np.sqrt(np.sum((samples[:4] - samples.mean()) ** 2) / 8)) < 1e-12
+    statistics.update(18, 0)
+    assert abs(statistics.standard_deviation(8) - samples.std()) < 1e-12
+
+
+def test_quantile_sketch_relative_accuracy():
+    values = np.random.default_rng(2).lognormal(3, 2, 20000)
+    qs = np.linspace(0, 1, 101)
+    for relative_accuracy in (0.01, 0.05):
+        sketch = QuantileSketch(relative_accuracy)
+        for value in values.tolist():
+            sketch.add(value)
+        exact = np.quantile(values, qs, method="lower")
+        for q, value in zip(qs.tolist(), exact.tolist()):
+            assert abs(sketch.quantile(q) - value) <= relative_accuracy * value * (1 + 1e-9), (q, value)
+
+
+def test_quantile_sketch_merge():
+    values = np.random.default_rng(3).exponential(100, 3000).tolist() + [0.0] * 10
+    whole, first, second = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (first if i % 2 == 0 else second).add(value)
+    first.merge(second).merge(QuantileSketch())
+    assert first.count == whole.count and first.zero_count == whole.zero_count == 10
+    assert first.quantiles([0, 0.5, 0.99, 1]) == whole.quantiles([0, 0.5, 0.99, 1])
+    assert first.min == 0 and first.max == max(values) and first.quantile(0) == 0
+    assert abs(first.quantile(1) - max(values)) <= first.relative_accuracy * max(values)
+    assert QuantileSketch().quantile(0.5) == -1
+    try:
+        first.merge(QuantileSketch(0.02))
+        raise AssertionError("merged sketches with different relative accuracy")
+    except ValueError:
+        pass
+
+
+def mser_reference(series, batch_size=5):
+    means = [np.mean(series[i:i + batch_size]) for i in range(0, series.__len__() // batch_size * batch_size,
+                                                               batch_size)]
+    statistics = [np.var(means[d:]) / (means.__len__() - d) for d in range(0, means.__len__() // 2 + 1)]
+    return int(np.argmin(statistics))
+
+
+def test_mser():
+    random = np.random.default_rng(6)
+    # a transient of 100 observations which decays into stationary noise
+    series = 50 * np.exp(-np.arange(1000) / 20) + random.normal(10, 1, 1000)
+    truncated = mser(series)
+    assert truncated == 5 * mser_reference(series)
+    assert 50 <= truncated <= 200
+    for _ in range(0, 20):
+        series = random.normal(0, 1, random.integers(10, 500))
+        truncated = mser(series.tolist())
+        reference = mser_reference(series)
+        assert truncated == (None if reference == series.__len__() // 5 // 2 else 5 * reference)
+
+
+def test_mser_too_short():
+    assert mser([1, 2, 3, 4, 5, 6, 7, 8, 9]) is None
+    # still decreasing at the end of the first half
+    assert mser(np.linspace(100, 0, 100)) is None
+
+
+def test_mser_warmup_needs_until():
+    env = build_scenario(scenario(False), 7)
+    for until in (None, 0):
+        try:
+            env.run(until, warmup="mser")
+            raise AssertionError("mser warm-up ran without a finite until")
+        except ValueError:
+            pass
+    env.run(20000, warmup="mser")
+    assert env.now == 20000
+
+
+def scenario(online):
+    return {"name": "online", "port_params": {"cbs": {"traffic_classes": 3, "tsa": {"1": "credit_based_shaper"},
+                                                      "bandwidth": {"1": 0.4}}},
+            "nodes": [{"type": "sink", "address": "Sink"},
+                      {"type": "switch", "address": "Switch", "monitor": True, "online": online},
+                      {"type": "flow2", "address": "Source", "monitor": True, "online": online,
+                       "frames": {"destination": "Sink", "priority": 4, "size": {"imix": "simple"}}}] +
+                     [{"type": "frame_injector", "address": "Injector%d" % priority, "target": "Switch",
+                       "bandwidth": 10, "intensity": {"distribution": "exponential", "intensity": 0.3},
+                       "monitor": True, "online": online,
+                       "frames": {"destination": "Sink", "priority": priority,
+                                  "payload": {"distribution": "uniform", "a": 250, "b": 1300}}}
+                      for priority in (0, 3, 6)],
+            "links": [{"nodes": ["Source", "Switch"], "port_params": ["cbs"]},
+                      {"nodes": ["Switch", "Sink"], "port_params": ["cbs"]}]}
+
+
+def assert_close(expected, actual, path=""):
+    if isinstance(expected, dict):
+        assert sorted(expected, key=str) == sorted(actual, key=str), path
+        for key in expected:
+            assert_close(expected[key], actual[key], "%s/%s" % (path, key))
+    else:
+        assert abs(expected - actual) <= 1e-6 * max(1, abs(expected)), (path, expected, actual)
+
+
+def test_online_results_match_tables():
+    results = []
+    for online in (False, True):
+        env = build_scenario(scenario(online), 7)
+        env.run(50000)
+        results.append(env.get_monitor_results())
+    assert_close(*results)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
@@ -0,0 +1,99 @@
+"""
+checks of simulation.topology, run with python -m pytest tests or python -m tests.test_topology
+"""
+import numpy as np
+
+from simulation.core import NetworkEnvironment
+from simulation.node import Sink
+from simulation.switch import Switch
+from simulation.topology import Topology, TOPOLOGIES, build_topology, fat_tree_topology, ring_topology
+
+ARGUMENTS = {"line": (4, 2), "ring": (5, 1), "star": (3,), "leaf_spine": (3, 2, 2), "fat_tree": (4,)}
+
+
+def environment():
+    return NetworkEnvironment("topology", 1, channel_types={"Fiber": 290.0}, verbose=False)
+
+
+def connect_links(env, topology, nodes):
+    for a, b, bandwidth, channel_length in zip(topology.node_a.tolist(), topology.node_b.tolist(),
+                                               topology.bandwidth.tolist(), topology.channel_length.tolist()):
+        env.builder.connect_nodes(nodes[a], nodes[b], bandwidth, "Fiber", channel_length)
+
+
+def test_connect_topology_equals_connect_nodes():
+    for name, arguments in ARGUMENTS.items():
+        topology = TOPOLOGIES[name](*arguments, channel_length=100)
+        topology_env = build_topology(environment(), topology, channel_type="Fiber")
+        env = environment()
+        nodes = [Switch(env, address) for address in topology.addresses[:topology.switch_count]] + \
+                [Sink(env, address) for address in topology.addresses[topology.switch_count:]]
+        env.builder.append_nodes(*nodes)
+        connect_links(env, topology, nodes)
+        assert dict(topology_env.builder.table) == dict(env.builder.table), name
+        for (sender, receiver), connection_type in env.builder.table2.items():
+            assert topology_env.builder.link(sender, receiver) == connection_type, (name, sender, receiver)
+
+
+def test_adjacency():
+    for name, arguments in ARGUMENTS.items():
+        topology = TOPOLOGIES[name](*arguments)
+        for node in range(0, topology.node_count):
+            for entry in range(topology.offsets[node], topology.offsets[node + 1]):
+                neighbour = topology.neighbours[entry]
+                # entry of the other direction of the link
+                reverse = topology.offsets[neighbour] + topology.ports_in[entry] - 1
+                assert topology.neighbours[reverse] == node and topology.links[reverse] == topology.links[entry]
+                assert {topology.node_a[topology.links[entry]], topology.node_b[topology.links[entry]]} == \
+                    {node, neighbour}
+    topology = fat_tree_topology(4)
+    assert topology.switch_count == 20 and topology.node_count == 36 and topology.link_count == 48
+    assert all(topology.degree(node) == 4 for node in range(0, topology.switch_count))
+    assert all(topology.degree(node) == 1 for node in range(topology.switch_count, topology.node_count))
+
+
+def test_existing_ports():
+    # a node with a port already connected by connect_nodes, the ports of the topology follow it
+    topology = ring_topology(3, 1)
+    env = environment()
+    injector = Sink(env, "Injector")
+    env.builder.append_nodes(injector)
+    nodes = [Switch(env, address) for address in topology.addresses[:topology.switch_count]] + \
+            [Sink(env, address) for address in topology.addresses[topology.switch_count:]]
+    env.builder.append_nodes(*nodes)
+    env.builder.connect_nodes(injector, nodes[0], 100, "Fiber", 10)
+    env.builder.connect_topology(topology, "Fiber")
+    assert env.builder.table["switch0"][1][0] == "Injector"
+    assert env.builder.link("switch0", "Injector") == [100, 10 / 290.0]
+    assert env.builder.link("switch0", "switch1") == [10.0, 0.0]
+    ports = env.builder.table["switch0"]
+    for port, (receiver, port_in, bandwidth, physical_delay) in ports.items():
+        assert env.builder.table[receiver][port_in][0] == "switch0"
+    try:
+        env.builder.link("host0_0", "switch1")
+        raise AssertionError("found a link between nodes which are not connected")
+    except KeyError:
+        pass
+
+
+def test_invalid_topologies():
+    for node_a, node_b in (([0, 1], [1]), ([0, 1], [1, 1])):
+        try:
+            Topology(["a", "b"], 2, node_a, node_b)
+            raise AssertionError("accepted links %s - %s" % (node_a, node_b))
+        except ValueError:
+            pass
+    for k in (0, 3):
+        try:
+            fat_tree_topology(k)
+            raise AssertionError("accepted a fat-tree with k=%d" % k)
+        except ValueError:
+            pass
+    assert np.array_equal(ring_topology(2, 0).node_a, [0])
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")